@@ -6,37 +6,1672 @@ import tempfile
 import time
 import uuid
 import socket
-import threading
 import shutil
 import httpx
 import io
-from contextlib import asynccontextmanager
-from urllib.parse import urljoin, urlparse, unquote
+import html
+import math
+import json
+import hashlib
+import heapq
+import sqlite3
+import weakref
+import fcntl
+import itertools
+import zlib
+import hmac
+import pstats
+import cProfile
+import tracemalloc
+from collections import OrderedDict, Counter, deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urljoin, urlparse, urlsplit, urlunsplit, unquote, urldefrag
 from typing import Dict, Set, Optional
 from datetime import datetime
 import uvloop
 import aiohttp
 import aiofiles
 from bs4 import BeautifulSoup
+import lxml.html
 from fastapi import FastAPI, Query, HTTPException, Request
-from fastapi.responses import FileResponse, JSONResponse, Response, HTMLResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import uvicorn
 
+# Optional decoders and HTTP/2 support, each feature is off when its package is missing
+try:
+    import brotli
+    if not hasattr(brotli.Decompressor, 'can_accept_more_data'):
+        brotli = None  # output_buffer_limit needs brotli >= 1.2
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 # Global storage
-STORE: Dict[str, Dict] = {}
+JOBS: Dict[str, Dict] = {}
 BASE_DIR = "/tmp/websource_files"
 os.makedirs(BASE_DIR, exist_ok=True)
 
+# Expiry and disk quota for everything under BASE_DIR across workers, measured every DISK_SCAN_INTERVAL seconds;
+# orphans younger than ORPHAN_GRACE may belong to a live capture
+DISK_QUOTA_BYTES = int(os.environ.get("DISK_QUOTA_MB", "1024")) * 1024 * 1024
+DISK_SCAN_INTERVAL = int(os.environ.get("DISK_SCAN_INTERVAL", "60"))
+ORPHAN_GRACE = int(os.environ.get("ORPHAN_GRACE", "600"))
+EXPIRY_SWEEP_INTERVAL = int(os.environ.get("EXPIRY_SWEEP_INTERVAL", "300"))
+
+# Profiled captures (?profile=1) need the X-Admin-Token header to match ADMIN_TOKEN; unset disables them
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "40"))
+PROFILE_LOCK = asyncio.Lock()
+
+# Blocking archive and filesystem work runs on a bounded thread pool, zlib releases the GIL
+BLOCKING_WORKERS = int(os.environ.get("BLOCKING_WORKERS", "8"))
+ARCHIVE_CONCURRENCY = int(os.environ.get("ARCHIVE_CONCURRENCY", "2"))
+BLOCKING_POOL = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="websource-io")
+ARCHIVE_SLOTS = asyncio.Semaphore(ARCHIVE_CONCURRENCY)
+ARCHIVES_RUNNING = 0
+
+# Per-member ZIP compression: already-compressed formats are STORED, text is DEFLATEd
+ZIP_DEFLATE_LEVEL = int(os.environ.get("ZIP_DEFLATE_LEVEL", "6"))
+STORED_EXTENSIONS = frozenset([
+    'png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'heic', 'woff', 'woff2', 'mp4', 'm4v', 'webm',
+    'mov', 'mp3', 'm4a', 'ogg', 'ogv', 'opus', 'zip', 'gz', 'tgz', 'br', 'zst', '7z', 'rar', 'xz'
+])
+DEFLATE_EXTENSIONS = frozenset([
+    'html', 'htm', 'css', 'js', 'mjs', 'json', 'map', 'svg', 'xml', 'txt', 'csv', 'ico', 'ttf', 'otf', 'eot'
+])
+
+# Artifact store backend shared by all workers: "memory", "sqlite" or "redis"
+ARTIFACT_STORE = os.environ.get("ARTIFACT_STORE", "memory")
+ARTIFACT_STORE_URL = os.environ.get("ARTIFACT_STORE_URL", "redis://127.0.0.1:6379/0")
+# ZIPs stay on the disk of the node that built them, only that node serves and deletes them
+NODE_ID = os.environ.get("NODE_ID") or socket.gethostname()
+
+# Outbound connection pool shared by every capture for the app lifetime
+POOL_LIMIT = int(os.environ.get("POOL_LIMIT", "150"))
+POOL_LIMIT_PER_HOST = int(os.environ.get("POOL_LIMIT_PER_HOST", "50"))
+POOL_KEEPALIVE = float(os.environ.get("POOL_KEEPALIVE", "30"))
+HTTP_POOL: Optional[aiohttp.TCPConnector] = None
+
+# Outbound transport: "aiohttp", or "httpx" (HTTP/2 when h2 is installed, no per-host pool cap); TRANSFER_COMPRESSION=0
+# asks origins for identity bodies, otherwise bodies are decoded in a stream and sized after decoding
+HTTP_TRANSPORT = os.environ.get("HTTP_TRANSPORT", "aiohttp")
+TRANSFER_COMPRESSION = os.environ.get("TRANSFER_COMPRESSION", "1") != "0"
+HTTPX_CLIENT: Optional[httpx.AsyncClient] = None
+
+# Content-addressed asset cache shared by every capture in a process. Each worker process locks
+# its own slot under CACHE_DIR, so disk use is up to one ASSET_CACHE_MAX_MB per worker;
+# incremental captures keep a manifest per start page next to it to revalidate against
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+MANIFEST_DIR = os.path.join(BASE_DIR, "manifests")
+MANIFEST_MAX_AGE = float(os.environ.get("MANIFEST_MAX_AGE_DAYS", "7")) * 86400
+CACHE_MAX_BYTES = int(os.environ.get("ASSET_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+# /api/web captures of the same URL and options share one run while in flight; successful
+# results are also reused for RESULT_CACHE_SECONDS afterwards (0 disables, capped by the 300s artifact TTL)
+RESULT_CACHE_SECONDS = min(int(os.environ.get("RESULT_CACHE_SECONDS", "0")), 300)
+
+# Background capture jobs, JOB_QUEUE_LIMIT bounds admission
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", "32"))
+
+# Streaming downloads: per-file limit is UrlDownloader.size_limit, the CAPTURE_MAX_* values
+# budget a whole capture (download and archive stages); CAPTURE_MAX_SECONDS=0 disables the clock
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_BYTES = 1024 * 1024
+CAPTURE_MAX_BYTES = int(os.environ.get("CAPTURE_MAX_MB", "19")) * 1024 * 1024
+CAPTURE_MAX_FILES = int(os.environ.get("CAPTURE_MAX_FILES", "1000"))
+CAPTURE_MAX_SECONDS = float(os.environ.get("CAPTURE_MAX_SECONDS", "60"))
+
+# Download order by asset folder, lower first: markup/styles/scripts, then images and fonts, media last
+ASSET_PRIORITIES = {'css': 0, 'js': 0, 'json': 0, 'xml': 0, 'txt': 0, 'images': 1, 'fonts': 1, 'documents': 2, 'media': 2}
+
+# Asset download scheduling, HOST_CONCURRENCY=0 leaves hosts uncapped
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "25"))
+HOST_CONCURRENCY = int(os.environ.get("HOST_CONCURRENCY", "0"))
+HOST_DELAY = float(os.environ.get("HOST_DELAY", "0"))
+ACTIVE_SCHEDULERS: "weakref.WeakSet" = weakref.WeakSet()
+
+# Stylesheet references: group 2 is an @import "..." target, group 4 a url(...) target
+CSS_REF_RE = re.compile(r'@import\s+(["\'])([^"\']*)\1|url\(\s*(["\']?)([^"\')]*)\3\s*\)', re.IGNORECASE)
+
+# Crawl mode: pages fetched at once per capture and the caps on the depth/max_pages parameters
+CRAWL_CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", "4"))
+CRAWL_MAX_DEPTH = int(os.environ.get("CRAWL_MAX_DEPTH", "5"))
+CRAWL_MAX_PAGES = int(os.environ.get("CRAWL_MAX_PAGES", "50"))
+
+# Query parameters dropped when deduplicating asset URLs, e.g. "v,ver,_" (a trailing * matches
+# a prefix, "utm_*"); off by default since some sites really serve different files per version
+CACHE_BUSTER_PARAMS = tuple(p.strip() for p in os.environ.get("CACHE_BUSTER_PARAMS", "").split(',') if p.strip())
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Quoted asset paths picked out of inline scripts
+SCRIPT_URL_RE = re.compile(r'["\']([^"\']*\.(?:js|css|png|jpg|jpeg|gif|svg|woff2?|ttf|eot|json|xml))["\']', re.IGNORECASE)
+
+# Keywords that hint at the type of an extensionless URL, in priority order;
+# the lookahead finds overlapping hits so the best-ranked one wins in one scan
+EXTENSION_HINTS = (
+    ('css', 'css'), ('style', 'css'), ('js', 'js'), ('javascript', 'js'), ('script', 'js'),
+    ('png', 'png'), ('jpg', 'jpg'), ('jpeg', 'jpeg'), ('gif', 'gif'), ('svg', 'svg'),
+    ('webp', 'webp'), ('ico', 'ico'), ('avif', 'avif'),
+    ('woff2', 'woff2'), ('woff', 'woff'), ('ttf', 'ttf'), ('otf', 'otf'), ('eot', 'eot'),
+    ('json', 'json'), ('manifest', 'json'), ('xml', 'xml')
+)
+EXTENSION_HINT_RE = re.compile('(?=(' + '|'.join(keyword for keyword, _ in EXTENSION_HINTS) + '))')
+EXTENSION_HINT_RANK = {keyword: (rank, ext) for rank, (keyword, ext) in enumerate(EXTENSION_HINTS)}
+
+# <link rel> values whose targets are captured regardless of the link flag
+LINK_RESOURCE_RELS = ('icon', 'shortcut icon', 'apple-touch-icon', 'manifest', 'alternate', 'canonical', 'preload', 'prefetch')
+
+# HTML parser backend for captures: "bs4" (prettified output), "lxml" (fast path)
+# or "splice" (original bytes with only the URL attribute values replaced)
+HTML_PARSER = os.environ.get("HTML_PARSER", "bs4")
+
 # Jinja2 templates
 templates = Jinja2Templates(directory="templates")
 
+async def run_blocking(fn, *args, **kwargs):
+    """Runs blocking filesystem work on BLOCKING_POOL"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(BLOCKING_POOL, partial(fn, *args, **kwargs))
+
+async def run_archive(fn, *args, **kwargs):
+    """Runs CPU-heavy archive work on BLOCKING_POOL, at most ARCHIVE_CONCURRENCY at a time"""
+    global ARCHIVES_RUNNING
+    async with ARCHIVE_SLOTS:
+        ARCHIVES_RUNNING += 1
+        try:
+            return await run_blocking(fn, *args, **kwargs)
+        finally:
+            ARCHIVES_RUNNING -= 1
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a periodic sleep, i.e. how long callbacks were blocked"""
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self.avg = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self.last = lag
+            self.max = max(self.max, lag)
+            self.avg = lag if not self.avg else self.avg * 0.9 + lag * 0.1
+
+    def stats(self):
+        return {
+            "last_ms": round(self.last * 1000, 2),
+            "avg_ms": round(self.avg * 1000, 2),
+            "max_ms": round(self.max * 1000, 2)
+        }
+
+LOOP_LAG = LoopLagMonitor()
+
+# Asset metrics get a host label for the first METRICS_MAX_HOSTS hosts seen, later hosts share "other"
+METRICS_MAX_HOSTS = int(os.environ.get("METRICS_MAX_HOSTS", "50"))
+METRIC_HOSTS = set()
+METRICS = []
+
+class Metric:
+    """One metric family, rendered in the Prometheus text exposition format"""
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+        METRICS.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def samples(self):
+        for key, value in list(self.values.items()):
+            yield self.name, self._label_text(key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {value:g}" if isinstance(value, float) else f"{name}{labels} {value}")
+        return '\n'.join(lines)
+
+class MetricCounter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class MetricGauge(Metric):
+    """Gauge that is either set directly or read from fn() at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), fn=None):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.fn is not None:
+            try:
+                yield self.name, '', self.fn()
+            except Exception:
+                pass
+            return
+        yield from super().samples()
+
+class MetricHistogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", self._label_text(key, [('le', f"{bound:g}")]), cumulative
+            yield f"{self.name}_bucket", self._label_text(key, [('le', '+Inf')]), count
+            yield f"{self.name}_sum", self._label_text(key), total
+            yield f"{self.name}_count", self._label_text(key), count
+
+def host_label(url):
+    """Host label for url, "other" once METRICS_MAX_HOSTS hosts are labelled"""
+    host = urlparse(url).netloc
+    if host not in METRIC_HOSTS:
+        if len(METRIC_HOSTS) >= METRICS_MAX_HOSTS:
+            return 'other'
+        METRIC_HOSTS.add(host)
+    return host
+
+def render_metrics():
+    return '\n'.join(metric.render() for metric in METRICS) + '\n'
+
+STAGE_SECONDS = MetricHistogram("websource_stage_seconds", "Time spent per capture stage", ("stage",))
+ASSET_SECONDS = MetricHistogram("websource_asset_download_seconds", "Asset fetch time by host (first METRICS_MAX_HOSTS, then other) and HTTP status (cache for fresh cache hits)", ("host", "status"))
+CAPTURES = MetricCounter("websource_captures_total", "Finished captures by result", ("result",))
+BYTES_IN = MetricCounter("websource_bytes_in_total", "Bytes downloaded from origin servers")
+BYTES_OUT = MetricCounter("websource_bytes_out_total", "Archive bytes sent to clients")
+CACHE_HITS = MetricCounter("websource_cache_hits_total", "Assets served from the asset cache, revalidations included")
+FAILED_URLS = MetricCounter("websource_failed_urls_total", "Assets that failed to download")
+SKIPPED_FILES = MetricCounter("websource_skipped_files_total", "Assets skipped for the size limit or capture budget")
+COALESCED = MetricCounter("websource_coalesced_requests_total", "/api/web requests answered by another request's capture", ("source",))
+CAPTURES_IN_FLIGHT = MetricGauge("websource_captures_in_flight", "Captures currently running")
+MetricGauge("websource_download_slots_in_use", "Asset downloads running across captures",
+            fn=lambda: sum(scheduler.in_flight for scheduler in list(ACTIVE_SCHEDULERS)))
+MetricGauge("websource_download_queue_depth", "Asset downloads waiting for a slot across captures",
+            fn=lambda: sum(scheduler.queued for scheduler in list(ACTIVE_SCHEDULERS)))
+MetricGauge("websource_archive_slots_in_use", "Archive builds holding one of the ARCHIVE_CONCURRENCY slots",
+            fn=lambda: ARCHIVES_RUNNING)
+MetricGauge("websource_job_queue_depth", "Background capture jobs waiting for a worker", fn=lambda: JOB_MANAGER.queued())
+MetricGauge("websource_asset_cache_bytes", "Bytes held by the asset cache", fn=lambda: ASSET_CACHE.total_size)
+MetricGauge("websource_loop_lag_seconds", "Last measured event loop lag", fn=lambda: LOOP_LAG.last)
+
+class ArtifactStore:
+    """Where finished ZIPs are registered; records carry their expiry in "exp".
+
+    get() never returns an expired record. expired() atomically claims expired
+    records so exactly one worker deletes their files.
+    """
+    async def put(self, key, record, ttl):
+        raise NotImplementedError
+
+    async def get(self, key):
+        raise NotImplementedError
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+    async def expired(self):
+        raise NotImplementedError
+
+    async def records(self):
+        raise NotImplementedError
+
+    async def count(self):
+        return len(await self.records())
+
+    async def close(self):
+        pass
+
+class MemoryArtifactStore(ArtifactStore):
+    """Process-local store, only valid with a single worker"""
+    def __init__(self):
+        self.data: Dict[str, Dict] = {}
+
+    async def put(self, key, record, ttl):
+        self.data[key] = dict(record, exp=time.time() + ttl)
+
+    async def get(self, key):
+        record = self.data.get(key)
+        if record is None or time.time() > record["exp"]:
+            return None
+        return record
+
+    async def delete(self, key):
+        return self.data.pop(key, None)
+
+    async def expired(self):
+        now = time.time()
+        dead = [(k, v) for k, v in self.data.items() if now > v["exp"]]
+        for k, _ in dead:
+            self.data.pop(k, None)
+        return dead
+
+    async def records(self):
+        now = time.time()
+        return [(k, v) for k, v in self.data.items() if now <= v["exp"]]
+
+class SQLiteArtifactStore(ArtifactStore):
+    """Store shared by every worker on one host through a WAL-mode SQLite file, one table per namespace"""
+    def __init__(self, path, table="artifacts"):
+        self.path = path
+        self.table = table
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, record TEXT NOT NULL, exp REAL NOT NULL)")
+            db.execute(f"CREATE INDEX IF NOT EXISTS {table}_exp ON {table} (exp)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def _run(self, fn, *args):
+        def call():
+            db = self._connect()
+            try:
+                return fn(db, *args)
+            finally:
+                db.close()
+        return run_blocking(call)
+
+    async def put(self, key, record, ttl):
+        exp = time.time() + ttl
+        record = dict(record, exp=exp)
+        await self._run(lambda db: db.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, record, exp) VALUES (?, ?, ?)",
+            (key, json.dumps(record), exp)
+        ))
+
+    async def get(self, key):
+        row = await self._run(lambda db: db.execute(
+            f"SELECT record FROM {self.table} WHERE key = ? AND exp >= ?", (key, time.time())
+        ).fetchone())
+        return json.loads(row[0]) if row else None
+
+    async def delete(self, key):
+        def delete(db):
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(f"SELECT record FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            db.execute("COMMIT")
+            return json.loads(row[0]) if row else None
+        return await self._run(delete)
+
+    async def expired(self):
+        def claim(db):
+            now = time.time()
+            db.execute("BEGIN IMMEDIATE")
+            rows = db.execute(f"SELECT key, record FROM {self.table} WHERE exp < ?", (now,)).fetchall()
+            db.execute(f"DELETE FROM {self.table} WHERE exp < ?", (now,))
+            db.execute("COMMIT")
+            return [(key, json.loads(record)) for key, record in rows]
+        return await self._run(claim)
+
+    async def records(self):
+        rows = await self._run(lambda db: db.execute(
+            f"SELECT key, record FROM {self.table} WHERE exp >= ?", (time.time(),)
+        ).fetchall())
+        return [(key, json.loads(record)) for key, record in rows]
+
+    async def count(self):
+        row = await self._run(lambda db: db.execute(
+            f"SELECT COUNT(*) FROM {self.table} WHERE exp >= ?", (time.time(),)
+        ).fetchone())
+        return row[0]
+
+class RedisArtifactStore(ArtifactStore):
+    """Store on any server speaking the Redis protocol (RESP2), shared across hosts.
+
+    Records live under "<prefix>:<key>" and their deadlines in the "<prefix>:exp"
+    sorted set, plus "<prefix>:exp:<node>" for the node that put them. expired()
+    only looks at this node's set, and a worker owns an expired record only if
+    its ZREM removed it there.
+
+    Any failure or cancellation mid-command drops the connection, because a
+    half-read reply would be taken as the answer to the next command. Only the
+    commands in RETRYABLE are resent on a fresh connection.
+    """
+    RETRYABLE = frozenset(["GET", "SET", "DEL", "ZADD", "ZRANGEBYSCORE", "ZCOUNT", "ZREMRANGEBYSCORE"])
+
+    def __init__(self, url, prefix="websource", node=NODE_ID):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip('/') or 0)
+        self.prefix = prefix
+        self.node = node
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._send("AUTH", self.password)
+        if self.db:
+            await self._send("SELECT", self.db)
+
+    def _drop(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._writer.write(b"".join(parts))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Artifact store connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RuntimeError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RuntimeError(f"Unexpected reply from artifact store: {line!r}")
+
+    async def command(self, *args):
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._send(*args)
+                except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                    self._drop()
+                    if attempt or args[0] not in self.RETRYABLE:
+                        raise
+                except BaseException:
+                    self._drop()
+                    raise
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    async def put(self, key, record, ttl):
+        exp = time.time() + ttl
+        record = dict(record, exp=exp)
+        await self.command("SET", self._key(key), json.dumps(record), "PX", int((ttl + 3600) * 1000))
+        await self.command("ZADD", self._key("exp"), exp, key)
+        await self.command("ZADD", self._key(f"exp:{self.node}"), exp, key)
+
+    async def get(self, key):
+        data = await self.command("GET", self._key(key))
+        if data is None:
+            return None
+        record = json.loads(data)
+        return record if time.time() <= record["exp"] else None
+
+    async def delete(self, key):
+        data = await self.command("GET", self._key(key))
+        await self.command("DEL", self._key(key))
+        await self.command("ZREM", self._key("exp"), key)
+        await self.command("ZREM", self._key(f"exp:{self.node}"), key)
+        return json.loads(data) if data else None
+
+    async def expired(self):
+        claimed = []
+        now = time.time()
+        keys = await self.command("ZRANGEBYSCORE", self._key(f"exp:{self.node}"), "-inf", now)
+        for key in keys or []:
+            key = key.decode()
+            if await self.command("ZREM", self._key(f"exp:{self.node}"), key) != 1:
+                continue
+            await self.command("ZREM", self._key("exp"), key)
+            data = await self.command("GET", self._key(key))
+            await self.command("DEL", self._key(key))
+            if data:
+                claimed.append((key, json.loads(data)))
+        # Deadlines of nodes that are gone, their records have expired through PX by now
+        await self.command("ZREMRANGEBYSCORE", self._key("exp"), "-inf", now - 3600)
+        return claimed
+
+    async def records(self):
+        live = []
+        keys = await self.command("ZRANGEBYSCORE", self._key("exp"), time.time(), "+inf")
+        for key in keys or []:
+            record = await self.get(key.decode())
+            if record is not None:
+                live.append((key.decode(), record))
+        return live
+
+    async def count(self):
+        return await self.command("ZCOUNT", self._key("exp"), time.time(), "+inf")
+
+    async def close(self):
+        self._drop()
+
+def create_artifact_store(kind=ARTIFACT_STORE, namespace="artifacts"):
+    if kind == "sqlite":
+        return SQLiteArtifactStore(os.path.join(BASE_DIR, "artifacts.db"), table=namespace)
+    if kind == "redis":
+        return RedisArtifactStore(ARTIFACT_STORE_URL, prefix=f"websource:{namespace}")
+    return MemoryArtifactStore()
+
+# Finished ZIPs, and job status snapshots kept apart so /download never serves a job record
+STORE = create_artifact_store()
+JOB_STORE = create_artifact_store(namespace="jobs")
+
+def accept_encoding():
+    if not TRANSFER_COMPRESSION:
+        return 'identity'
+    encodings = ['gzip', 'deflate']
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    return ', '.join(encodings)
+
+class BodyDecoder:
+    """Streaming Content-Encoding decoder that yields pieces of about DOWNLOAD_CHUNK_SIZE.
+
+    Every decoder is output-capped: zlib through max_length, brotli through
+    output_buffer_limit and zstd by pulling from a stream_reader. Callers size-check
+    each piece and stop iterating, so a compressed bomb is never expanded past the
+    limit. Call finish() after the last chunk for output that is still buffered.
+    """
+    # A zstd stream_reader treats an empty read as the end of input, so it is only pulled while
+    # a whole block (128 KiB at most) plus read slack is buffered, and drained in finish()
+    ZSTD_READ_SIZE = 8192
+    ZSTD_HEADROOM = DOWNLOAD_CHUNK_SIZE + 128 * 1024 + 2 * ZSTD_READ_SIZE
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._zlib = None
+        self._brotli = None
+        self._zstd = None
+        if encoding in ('gzip', 'x-gzip'):
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._zlib = zlib.decompressobj()
+        elif encoding == 'br' and brotli is not None:
+            self._brotli = brotli.Decompressor()
+        elif encoding == 'zstd' and zstandard is not None:
+            self._pending = bytearray()
+            self._zstd = zstandard.ZstdDecompressor().stream_reader(self, read_size=self.ZSTD_READ_SIZE, read_across_frames=True)
+        elif encoding not in ('', 'identity'):
+            raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+        self._started = False
+
+    @classmethod
+    def for_response(cls, response):
+        return cls(response.headers.get('content-encoding', '').strip().lower())
+
+    def decode(self, data):
+        if self._zlib is not None:
+            yield from self._inflate(data)
+        elif self._brotli is not None:
+            yield from self._unbrotli(data)
+        elif self._zstd is not None:
+            self._pending += data
+            yield from self._unzstd(self.ZSTD_HEADROOM)
+        elif data:
+            yield data
+
+    def finish(self):
+        if self._brotli is not None:
+            while not self._brotli.is_finished():
+                piece = self._brotli.process(b'', output_buffer_limit=DOWNLOAD_CHUNK_SIZE)
+                if not piece:
+                    return
+                yield piece
+        elif self._zstd is not None:
+            yield from self._unzstd(0)
+
+    def read(self, size=-1):
+        """Input side of the zstd stream_reader"""
+        size = len(self._pending) if size < 0 else size
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+        return data
+
+    def _inflate(self, data):
+        while True:
+            try:
+                piece = self._zlib.decompress(data, DOWNLOAD_CHUNK_SIZE)
+            except zlib.error:
+                # Some servers send raw DEFLATE without the zlib header
+                if self.encoding != 'deflate' or self._started:
+                    raise
+                self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+                piece = self._zlib.decompress(data, DOWNLOAD_CHUNK_SIZE)
+            self._started = True
+            data = self._zlib.unconsumed_tail
+            if piece:
+                yield piece
+            if not data and len(piece) < DOWNLOAD_CHUNK_SIZE:
+                return
+
+    def _unbrotli(self, data):
+        piece = self._brotli.process(data, output_buffer_limit=DOWNLOAD_CHUNK_SIZE)
+        while True:
+            if piece:
+                yield piece
+            if self._brotli.can_accept_more_data():
+                return
+            piece = self._brotli.process(b'', output_buffer_limit=DOWNLOAD_CHUNK_SIZE)
+
+    def _unzstd(self, headroom):
+        while len(self._pending) >= headroom:
+            piece = self._zstd.read(DOWNLOAD_CHUNK_SIZE)
+            if not piece:
+                return
+            yield piece
+
+class AssetCache:
+    """Size-bounded LRU of asset bodies keyed by URL, bodies are stored once per sha256 on disk.
+
+    The index lives in this process only, so the cache works in a slot directory
+    (slot-0, slot-1, ...) under base that it holds an flock on. A restarted worker
+    takes over a free slot with its saved index; no two processes share one.
+    """
+    def __init__(self, base, max_bytes):
+        self.base = base
+        self.root = None
+        self._lock = None
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.refs: Dict[str, int] = {}
+        self.sizes: Dict[str, int] = {}
+        self.total_size = 0
+        self.removing: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    def claim(self):
+        """Locks the first free slot directory and uses it as root"""
+        if self.root is not None:
+            return
+        for slot in itertools.count():
+            root = os.path.join(self.base, f"slot-{slot}")
+            os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+            lock = open(os.path.join(root, "lock"), 'w')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock.close()
+                continue
+            self.root, self._lock = root, lock
+            return
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, "objects", digest)
+
+    def lookup(self, url):
+        entry = self.entries.get(url)
+        if entry is not None:
+            self.entries.move_to_end(url)
+        return entry
+
+    def is_fresh(self, entry):
+        return not entry["no_cache"] and time.time() < entry["expires"]
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def object_path(self, entry):
+        return self._object_path(entry["hash"])
+
+    def has_object(self, digest):
+        return digest in self.refs
+
+    def _policy(self, headers):
+        """Returns (storable, no_cache, expires) from the response caching headers"""
+        directives = {}
+        for part in headers.get('cache-control', '').lower().split(','):
+            name, _, value = part.strip().partition('=')
+            if name:
+                directives[name] = value.strip('"')
+        if 'no-store' in directives or 'private' in directives:
+            return False, False, 0
+        now = time.time()
+        expires = now
+        try:
+            for name in ('s-maxage', 'max-age'):
+                if name in directives:
+                    expires = now + int(directives[name])
+                    break
+            else:
+                if headers.get('expires'):
+                    expires = parsedate_to_datetime(headers['expires']).timestamp()
+                elif headers.get('last-modified'):
+                    age = now - parsedate_to_datetime(headers['last-modified']).timestamp()
+                    expires = now + min(max(age, 0) * 0.1, 86400)
+        except (TypeError, ValueError):
+            expires = now
+        no_cache = 'no-cache' in directives
+        validators = headers.get('etag') or headers.get('last-modified')
+        return bool(validators) or expires > now, no_cache, expires
+
+    def begin(self, url, headers):
+        """Returns a writer that streams a response body into the cache, or None if it is not storable"""
+        storable, no_cache, expires = self._policy(headers)
+        if not storable:
+            return None
+        self.claim()
+        return CacheWriter(self, url, {
+            "etag": headers.get('etag'),
+            "last_modified": headers.get('last-modified'),
+            "expires": expires,
+            "no_cache": no_cache
+        })
+
+    def _install(self, tmp_path, digest):
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+
+    async def _add(self, url, meta, tmp_path, digest, size):
+        if digest not in self.refs:
+            self.refs[digest] = 0
+            self.sizes[digest] = size
+            self.total_size += size
+            if digest in self.removing:
+                await asyncio.shield(self.removing[digest])
+            await run_blocking(self._install, tmp_path, digest)
+        else:
+            await run_blocking(os.remove, tmp_path)
+        old = self.entries.pop(url, None)
+        self.refs[digest] += 1
+        unreferenced = [old["hash"]] if old is not None and self._release(old["hash"]) else []
+        self.entries[url] = dict(meta, hash=digest)
+        await self._remove(unreferenced + self._evict_digests())
+
+    async def refresh(self, url, headers):
+        """Applies the headers of a 304 to a cached entry"""
+        entry = self.entries.get(url)
+        if entry is None:
+            return
+        cache_control = headers.get('cache-control', '').lower()
+        if 'no-store' in cache_control or 'private' in cache_control:
+            await self.discard(url)
+            return
+        _, no_cache, expires = self._policy(headers)
+        entry["expires"] = expires
+        entry["no_cache"] = no_cache
+        entry["etag"] = headers.get('etag') or entry["etag"]
+        entry["last_modified"] = headers.get('last-modified') or entry["last_modified"]
+
+    async def discard(self, url):
+        entry = self.entries.pop(url, None)
+        if entry is not None and self._release(entry["hash"]):
+            await self._remove([entry["hash"]])
+
+    def _release(self, digest):
+        """Drops one reference, True when the object is no longer used and can be removed"""
+        self.refs[digest] -= 1
+        if self.refs[digest] > 0:
+            return False
+        del self.refs[digest]
+        self.total_size -= self.sizes.pop(digest, 0)
+        return True
+
+    def _evict_digests(self):
+        """Pops LRU entries until the cache fits max_bytes, returns the objects left unreferenced"""
+        unreferenced = []
+        while self.total_size > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            if self._release(entry["hash"]):
+                unreferenced.append(entry["hash"])
+        return unreferenced
+
+    def _remove_objects(self, digests):
+        for digest in digests:
+            try:
+                os.remove(self._object_path(digest))
+            except OSError:
+                pass
+
+    async def _remove(self, digests):
+        """Removes unreferenced objects on BLOCKING_POOL; _add waits for a pending removal of its digest"""
+        if not digests:
+            return
+        removal = asyncio.ensure_future(run_blocking(self._remove_objects, digests))
+        for digest in digests:
+            self.removing[digest] = removal
+
+        def done(_):
+            for digest in digests:
+                if self.removing.get(digest) is removal:
+                    del self.removing[digest]
+        removal.add_done_callback(done)
+        await asyncio.shield(removal)
+
+    def load(self):
+        """Claims a slot, restores the index its previous owner saved and drops unreferenced objects"""
+        self.claim()
+        try:
+            with open(os.path.join(self.root, "index.json")) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = []
+        for url, entry in saved:
+            path = self._object_path(entry["hash"])
+            if not os.path.exists(path):
+                continue
+            if entry["hash"] not in self.refs:
+                self.refs[entry["hash"]] = 0
+                self.sizes[entry["hash"]] = os.path.getsize(path)
+                self.total_size += self.sizes[entry["hash"]]
+            self.refs[entry["hash"]] += 1
+            self.entries[url] = entry
+        for name in os.listdir(os.path.join(self.root, "objects")):
+            if name not in self.refs:
+                try:
+                    path = self._object_path(name)
+                    if name.endswith('.tmp') and time.time() - os.path.getmtime(path) < ORPHAN_GRACE:
+                        continue
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._remove_objects(self._evict_digests())
+
+    def save(self):
+        if self.root is None:
+            return
+        tmp_path = os.path.join(self.root, "index.json.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self.entries.items()), f)
+        os.replace(tmp_path, os.path.join(self.root, "index.json"))
+
+class CacheWriter:
+    """Hashes and spools a response body into the cache while it is downloaded"""
+    def __init__(self, cache, url, meta):
+        self.cache = cache
+        self.url = url
+        self.meta = meta
+        self.tmp_path = os.path.join(cache.root, "objects", f"{uuid.uuid4().hex}.tmp")
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.file = None
+
+    async def write(self, chunk):
+        if self.file is None:
+            self.file = await aiofiles.open(self.tmp_path, 'wb')
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+        await self.file.write(chunk)
+
+    async def commit(self):
+        if self.file is None:
+            return
+        await self.file.close()
+        if self.size > self.cache.max_bytes:
+            await run_blocking(os.remove, self.tmp_path)
+            return
+        await self.cache._add(self.url, self.meta, self.tmp_path, self.hasher.hexdigest(), self.size)
+
+    async def abort(self):
+        if self.file is None:
+            return
+        await self.file.close()
+        try:
+            await run_blocking(os.remove, self.tmp_path)
+        except OSError:
+            pass
+
+ASSET_CACHE = AssetCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+class SiteManifest:
+    """Assets of the last incremental capture from one start page, by canonical URL:
+    ETag, Last-Modified, sha256 of the body and path in the archive.
+
+    Bodies of assets with validators are kept in the manifest's own objects/
+    folder (hard links into the asset cache where possible), so a 304 can still
+    be answered after the cache has evicted them. Manifests are keyed by the
+    canonical page URL, so captures of different pages on one site keep their
+    own state.
+    """
+    def __init__(self, page, entries=None, captured=None, objects=None):
+        self.page = page
+        self.folder = os.path.join(MANIFEST_DIR, hashlib.sha1(page.encode()).hexdigest())
+        self.entries: Dict[str, Dict] = entries or {}
+        self.captured = captured
+        self.objects: Set[str] = objects or set()
+
+    def _object_path(self, digest):
+        return os.path.join(self.folder, "objects", digest)
+
+    @classmethod
+    def load(cls, page):
+        manifest = cls(page)
+        try:
+            manifest.objects = set(os.listdir(os.path.join(manifest.folder, "objects")))
+            with open(os.path.join(manifest.folder, "manifest.json")) as f:
+                data = json.load(f)
+            manifest.entries, manifest.captured = data["entries"], data["captured"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return manifest
+
+    def save(self, cache, pagefolder):
+        """Stores the bodies the entries need and writes manifest.json; the flock keeps two
+        workers saving the same page from dropping each other's objects"""
+        objects_dir = os.path.join(self.folder, "objects")
+        os.makedirs(objects_dir, exist_ok=True)
+        with open(os.path.join(self.folder, "lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            present = set(os.listdir(objects_dir))
+            for record in self.entries.values():
+                if (record.get("etag") or record.get("last_modified")) and record["hash"] not in present:
+                    if self._store_body(record, cache, pagefolder):
+                        present.add(record["hash"])
+            tmp_path = os.path.join(self.folder, f"manifest.json.{uuid.uuid4().hex}.tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump({"page": self.page, "captured": self.captured, "entries": self.entries}, f)
+            os.replace(tmp_path, os.path.join(self.folder, "manifest.json"))
+            needed = {record["hash"] for record in self.entries.values()}
+            for name in present - needed:
+                try:
+                    os.remove(self._object_path(name))
+                except OSError:
+                    pass
+            self.objects = present & needed
+
+    def _store_body(self, record, cache, pagefolder):
+        """Links the body from the asset cache, or copies the captured file if it is unmodified"""
+        target = self._object_path(record["hash"])
+        if cache is not None and cache.has_object(record["hash"]):
+            try:
+                os.link(cache.object_path(record), target)
+                return True
+            except FileExistsError:
+                return True
+            except OSError:
+                pass
+        source = os.path.join(pagefolder, record["path"])
+        try:
+            digest = hashlib.sha256()
+            with open(source, 'rb') as f:
+                for chunk in iter(partial(f.read, DOWNLOAD_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            if digest.hexdigest() != record["hash"]:
+                return False
+            shutil.copyfile(source, target)
+            return True
+        except OSError:
+            return False
+
+    def cache_entry(self, url):
+        """A stale cache-style entry for url backed by the stored body, so it gets revalidated"""
+        record = self.entries.get(url)
+        if record is None or not (record.get("etag") or record.get("last_modified")):
+            return None
+        if record["hash"] not in self.objects:
+            return None
+        return {
+            "hash": record["hash"],
+            "object_path": self._object_path(record["hash"]),
+            "etag": record.get("etag"),
+            "last_modified": record.get("last_modified"),
+            "expires": 0,
+            "no_cache": True
+        }
+
+    def diff(self, snapshot):
+        """Splits snapshot (same shape as entries) into new, changed and unchanged URLs, plus removed ones"""
+        delta = {"new": [], "changed": [], "unchanged": [], "removed": sorted(set(self.entries) - set(snapshot))}
+        for url, record in snapshot.items():
+            previous = self.entries.get(url)
+            if previous is None:
+                delta["new"].append(url)
+            elif previous["hash"] == record["hash"] and previous.get("path") == record.get("path"):
+                delta["unchanged"].append(url)
+            else:
+                delta["changed"].append(url)
+        return delta
+
+    def update(self, snapshot):
+        self.entries = {url: record for url, record in snapshot.items() if "path" in record}
+        self.captured = time.time()
+
+def prune_manifests(max_age=MANIFEST_MAX_AGE):
+    """Removes the manifests, and their stored bodies, of pages not captured for max_age seconds"""
+    try:
+        folders = os.listdir(MANIFEST_DIR)
+    except OSError:
+        return
+    for name in folders:
+        folder = os.path.join(MANIFEST_DIR, name)
+        try:
+            if time.time() - os.path.getmtime(os.path.join(folder, "manifest.json")) > max_age:
+                shutil.rmtree(folder, ignore_errors=True)
+        except OSError:
+            pass
+
+def prune_unchanged(folder, snapshot, delta, base_captured):
+    """Turns a capture folder into a delta: unchanged assets are removed and _delta.json lists what to keep"""
+    for url in delta["unchanged"]:
+        try:
+            os.remove(os.path.join(folder, snapshot[url]["path"]))
+        except OSError:
+            pass
+    with open(os.path.join(folder, "_delta.json"), 'w') as f:
+        json.dump({
+            "base_captured_at": datetime.fromtimestamp(base_captured).isoformat() if base_captured else None,
+            "unchanged": sorted(snapshot[url]["path"] for url in delta["unchanged"]),
+            "removed": delta["removed"]
+        }, f, indent=2)
+
+class MemorySink:
+    """Keeps a download in memory, used for stylesheets that are rewritten after download"""
+    def __init__(self):
+        self.data = bytearray()
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    async def write(self, chunk):
+        self.data += chunk
+
+    async def abort(self):
+        self.data = bytearray()
+
+class FileSink:
+    """Streams a download into <path>.part and renames it into place on commit"""
+    def __init__(self, path):
+        self.path = path
+        self.part_path = f"{path}.part"
+        self.size = 0
+        self.file = None
+
+    async def write(self, chunk):
+        if self.file is None:
+            await run_blocking(os.makedirs, os.path.dirname(self.path) or '.', exist_ok=True)
+            self.file = await aiofiles.open(self.part_path, 'wb')
+        self.size += len(chunk)
+        await self.file.write(chunk)
+
+    async def commit(self):
+        if self.file is not None:
+            await self.file.close()
+            await run_blocking(os.replace, self.part_path, self.path)
+
+    async def abort(self):
+        if self.file is not None:
+            await self.file.close()
+            self.file = None
+            try:
+                await run_blocking(os.remove, self.part_path)
+            except OSError:
+                pass
+
+class SpoolSink:
+    """Buffers a download for a streamed archive member, spilling to disk above SPOOL_MAX_BYTES"""
+    def __init__(self, archive, arcname):
+        self.archive = archive
+        self.arcname = arcname
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, dir=BASE_DIR)
+
+    async def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > SPOOL_MAX_BYTES:
+            await run_blocking(self.file.write, chunk)
+        else:
+            self.file.write(chunk)
+
+    async def commit(self):
+        self.archive.add(self.arcname, self.file)
+
+    async def abort(self):
+        self.file.close()
+
+class CaptureBudget:
+    """Byte, file and wall-time limits for one capture, shared by the downloader and the archive stage"""
+    def __init__(self, max_bytes=CAPTURE_MAX_BYTES, max_files=CAPTURE_MAX_FILES, max_seconds=CAPTURE_MAX_SECONDS):
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_seconds = max_seconds
+        self.started = time.monotonic()
+        self.bytes_used = 0
+        self.files_started = 0
+        self.skipped = 0
+
+    def expired(self):
+        return bool(self.max_seconds) and time.monotonic() - self.started > self.max_seconds
+
+    def admit(self):
+        """Claims a file slot for a download about to start, False once any limit is reached"""
+        if self.files_started >= self.max_files or self.bytes_used >= self.max_bytes or self.expired():
+            self.skipped += 1
+            return False
+        self.files_started += 1
+        return True
+
+    def fits(self, incoming):
+        return self.bytes_used + incoming <= self.max_bytes and not self.expired()
+
+    def charge(self, size):
+        self.bytes_used += size
+
+    def release(self, size):
+        """Gives back the slot and bytes of a download that was dropped"""
+        self.files_started -= 1
+        self.bytes_used -= size
+
+    def stats(self):
+        return {
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "files_started": self.files_started,
+            "max_files": self.max_files,
+            "skipped": self.skipped,
+            "elapsed_seconds": round(time.monotonic() - self.started, 3)
+        }
+
+class DownloadScheduler:
+    """Sliding-window work queue: a job starts as soon as a slot frees up, hosts are served round-robin
+    and the lowest priority value goes first; with a budget, jobs are dropped once it is spent"""
+    def __init__(self, concurrency=DOWNLOAD_CONCURRENCY, per_host=HOST_CONCURRENCY, host_delay=HOST_DELAY, budget=None):
+        self.concurrency = concurrency
+        self.per_host = per_host or concurrency
+        self.host_delay = host_delay
+        self.budget = budget
+        self.queued = 0
+        self.skipped = 0
+        self._seq = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.peak_in_flight = 0
+        self._queues: Dict[str, list] = {}
+        self._rotation: deque = deque()
+        self._host_active: Dict[str, int] = {}
+        self._next_start: Dict[str, float] = {}
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = []
+        ACTIVE_SCHEDULERS.add(self)
+
+    def submit(self, host, job, priority=0, on_skip=None):
+        """Queues job, a zero-argument coroutine function, under host; on_skip is called
+        instead of job when the budget drops it"""
+        if host not in self._queues:
+            self._queues[host] = []
+            self._rotation.append(host)
+        self._seq += 1
+        heapq.heappush(self._queues[host], (priority, self._seq, job, on_skip))
+        self.queued += 1
+        self._idle.clear()
+        self._wakeup.set()
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def join(self):
+        try:
+            await self._idle.wait()
+        finally:
+            self.close()
+
+    def close(self):
+        """Cancels the workers, queued jobs are left undone"""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "skipped": self.skipped,
+            "peak_in_flight": self.peak_in_flight,
+            "hosts": len(self._queues)
+        }
+
+    def _next_job(self):
+        """Returns (host, (job, on_skip), None) for the next eligible host, or (None, None, seconds to wait)"""
+        now = time.monotonic()
+        wait = None
+        best = None
+        for host in self._rotation:
+            if self._host_active.get(host, 0) >= self.per_host:
+                continue
+            ready_at = self._next_start.get(host, 0)
+            if ready_at > now:
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                continue
+            if best is None or self._queues[host][0][0] < self._queues[best][0][0]:
+                best = host
+        if best is None:
+            return None, None, wait
+        self._rotation.remove(best)
+        queue = self._queues[best]
+        _, _, job, on_skip = heapq.heappop(queue)
+        if queue:
+            self._rotation.append(best)
+        else:
+            del self._queues[best]
+        if self.host_delay:
+            self._next_start[best] = now + self.host_delay
+        return best, (job, on_skip), None
+
+    async def _worker(self):
+        while True:
+            host, entry, wait = self._next_job()
+            if entry is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.queued -= 1
+            job, on_skip = entry
+            if self.budget is not None and not self.budget.admit():
+                self.skipped += 1
+                if on_skip is not None:
+                    on_skip()
+                if self.queued == 0 and self.in_flight == 0:
+                    self._idle.set()
+                continue
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self._host_active[host] = self._host_active.get(host, 0) + 1
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+            finally:
+                self.in_flight -= 1
+                self.completed += 1
+                self._host_active[host] -= 1
+                self._wakeup.set()
+                if self.queued == 0 and self.in_flight == 0:
+                    self._idle.set()
+
+# Byte order marks override any declared charset, as in browsers
+BYTE_ORDER_MARKS = ((b'\xef\xbb\xbf', 'utf-8'), (b'\xff\xfe', 'utf-16-le'), (b'\xfe\xff', 'utf-16-be'))
+
+def sniff_encoding(content, content_type=''):
+    """Returns (encoding, declared_in_document) for an HTML body"""
+    for bom, encoding in BYTE_ORDER_MARKS:
+        if content.startswith(bom):
+            return encoding, False
+    match = re.search(rb'<meta[^>]+charset\s*=\s*["\']?([\w-]+)', content[:2048], re.IGNORECASE)
+    if match:
+        return match.group(1).decode('ascii').lower(), True
+    match = re.search(r'charset=([\w-]+)', content_type or '', re.IGNORECASE)
+    if match:
+        return match.group(1).lower(), False
+    try:
+        content.decode('utf-8')
+        return 'utf-8', False
+    except UnicodeDecodeError:
+        return 'cp1252', False
+
+def utf16_to_utf8(content, content_type=''):
+    """Re-encodes a UTF-16 body as UTF-8 for the byte-oriented parsers, returns (content, content_type).
+
+    The UTF-8 byte order mark is kept so it still outranks a stale <meta charset>.
+    """
+    encoding, _ = sniff_encoding(content[:2])
+    if not encoding.startswith('utf-16'):
+        return content, content_type
+    return BYTE_ORDER_MARKS[0][0] + content[2:].decode(encoding, errors='replace').encode('utf-8'), 'text/html; charset=utf-8'
+
+class SoupDocument:
+    """BeautifulSoup backend, output is prettified like it always was"""
+    def __init__(self, content, content_type=''):
+        try:
+            self.root = BeautifulSoup(content, features="lxml")
+        except:
+            self.root = BeautifulSoup(content, features="html.parser")
+
+    def elements(self):
+        for tag in self.root.find_all(True):
+            yield tag, tag.name, tag.attrs
+
+    def text(self, tag):
+        return tag.string
+
+    def set_attr(self, tag, attr, value):
+        tag[attr] = value
+
+    def serialize(self):
+        return self.root.prettify('utf-8')
+
+class LxmlDocument:
+    """lxml.html backend, serialized as parsed without reformatting"""
+    def __init__(self, content, content_type=''):
+        content, content_type = utf16_to_utf8(content, content_type)
+        encoding, declared = sniff_encoding(content, content_type)
+        try:
+            parser = lxml.html.HTMLParser(encoding=encoding)
+        except LookupError:
+            encoding, parser = 'utf-8', lxml.html.HTMLParser(encoding='utf-8')
+        self.encoding = encoding if declared else 'utf-8'
+        self.bom = BYTE_ORDER_MARKS[0][0] if content.startswith(BYTE_ORDER_MARKS[0][0]) else b''
+        self.has_doctype = re.match(rb'\s*(<\?xml[^>]*>\s*)?<!doctype', content[len(self.bom):512], re.IGNORECASE) is not None
+        self.root = lxml.html.document_fromstring(content, parser=parser)
+
+    def elements(self):
+        for element in self.root.iter():
+            if isinstance(element.tag, str):
+                yield element, element.tag, element.attrib
+
+    def text(self, element):
+        return element.text
+
+    def set_attr(self, element, attr, value):
+        element.set(attr, value)
+
+    def serialize(self):
+        doctype = self.root.getroottree().docinfo.doctype if self.has_doctype else None
+        return self.bom + lxml.html.tostring(self.root, encoding=self.encoding, doctype=doctype or None)
+
+# Start tags that can reference resources, comments are matched first so their contents are skipped
+TAG_SCAN_RE = re.compile(
+    r'''<!--.*?-->'''
+    r'''|<(script|style)\b((?:[^>"']|"[^"]*"|'[^']*')*)>(.*?)</\1\s*>'''
+    r'''|<(a|link|img|source|audio|video|embed|object|meta)\b((?:[^>"']|"[^"]*"|'[^']*')*)>''',
+    re.DOTALL | re.IGNORECASE
+)
+ATTR_SPAN_RE = re.compile(r'''([^\s/>="'][^\s/>=]*)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?''')
+
+def scan_resource_tags(text):
+    """Returns the resource tags of latin-1 decoded HTML with absolute attribute value spans"""
+    elements = []
+    for match in TAG_SCAN_RE.finditer(text):
+        if match.group(1):
+            name, attrs_group, body = match.group(1).lower(), 2, match.group(3)
+        elif match.group(4):
+            name, attrs_group, body = match.group(4).lower(), 5, None
+        else:
+            continue
+        spans = {}
+        offset = match.start(attrs_group)
+        for attr in ATTR_SPAN_RE.finditer(match.group(attrs_group)):
+            attr_name = attr.group(1).lower()
+            if attr_name not in spans and attr.group(2) is not None:
+                spans[attr_name] = (offset + attr.start(2), offset + attr.end(2))
+        elements.append({"name": name, "spans": spans, "end": offset, "text": body})
+    return elements
+
+class SpliceDocument:
+    """Scans the original bytes for URL attributes and splices new values in on output.
+
+    Nothing is re-serialized: the output is the source with only the edited
+    attribute values replaced, so formatting is preserved and the memory held
+    is the source plus the list of edits.
+    """
+    def __init__(self, content, content_type=''):
+        content, content_type = utf16_to_utf8(content, content_type)
+        self.content = content
+        self.encoding, _ = sniff_encoding(content, content_type)
+        try:
+            b''.decode(self.encoding)
+        except LookupError:
+            self.encoding = 'utf-8'
+        self.edits = []
+        self.elements_found = scan_resource_tags(content.decode('latin-1'))
+
+    def _decode(self, start, end):
+        raw = self.content[start:end].decode(self.encoding, errors='replace')
+        if raw[:1] in ('"', "'"):
+            raw = raw[1:-1]
+        return html.unescape(raw)
+
+    def elements(self):
+        for element in self.elements_found:
+            attrs = {attr: self._decode(*span) for attr, span in element["spans"].items()}
+            yield element, element["name"], attrs
+
+    def text(self, element):
+        if not element["text"]:
+            return None
+        return element["text"].encode('latin-1').decode(self.encoding, errors='replace')
+
+    def set_attr(self, element, attr, value):
+        quoted = f'"{html.escape(value, quote=True)}"'.encode(self.encoding, errors='xmlcharrefreplace')
+        span = element["spans"].get(attr)
+        if span:
+            self.edits.append((span[0], span[1], quoted))
+        else:
+            self.edits.append((element["end"], element["end"], b' ' + attr.encode('ascii') + b'=' + quoted))
+
+    def iter_chunks(self):
+        position = 0
+        for start, end, value in sorted(self.edits, key=lambda edit: edit[0]):
+            if start < position:
+                continue
+            yield self.content[position:start]
+            yield value
+            position = end
+        yield self.content[position:]
+
+    def serialize(self):
+        return b''.join(self.iter_chunks())
+
+HTML_PARSERS = {"bs4": SoupDocument, "lxml": LxmlDocument, "splice": SpliceDocument}
+
+def is_cache_buster(name, rules=CACHE_BUSTER_PARAMS):
+    for rule in rules:
+        if name == rule or (rule.endswith('*') and name.startswith(rule[:-1])):
+            return True
+    return False
+
+def canonicalize_url(url, rules=CACHE_BUSTER_PARAMS):
+    """Dedup key for url: no fragment, lower-case scheme and host, no default port,
+    '/' for an empty path and cache-buster parameters matching rules removed"""
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url.partition('#')[0]
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f"[{host}]"
+    userinfo, at, _ = parts.netloc.rpartition('@')
+    netloc = f"{userinfo}{at}{host}"
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    query = parts.query
+    if rules and query:
+        query = '&'.join(pair for pair in query.split('&') if not is_cache_buster(pair.split('=', 1)[0], rules))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+class ResourceRecord:
+    """What a capture needs to know about one asset URL, computed once"""
+    __slots__ = ('url', 'extension', 'folder', 'local_path')
+
+    def __init__(self, url, extension, folder, local_path):
+        self.url = url
+        self.extension = extension
+        self.folder = folder
+        self.local_path = local_path
+
+class ResourceClassifier:
+    """Parses each asset URL once into a cached ResourceRecord.
+
+    local_path is the archive-relative path before de-duplication, the name
+    PathAllocator starts from; URLs without a path get a generated file name.
+    """
+    def __init__(self, extensions):
+        self.extensions = extensions
+        self._records: Dict[str, ResourceRecord] = {}
+
+    def classify(self, url):
+        record = self._records.get(url)
+        if record is None:
+            record = self._records[url] = self._build(url)
+        return record
+
+    def guess_extension(self, url):
+        best = None
+        for match in EXTENSION_HINT_RE.finditer(url.lower()):
+            hint = EXTENSION_HINT_RANK[match.group(1)]
+            if best is None or hint < best:
+                best = hint
+                if hint[0] == 0:
+                    break
+        return best[1] if best else None
+
+    def _build(self, url):
+        parsed_url = urlparse(url)
+        path = unquote(parsed_url.path)
+        if not path or path == '/':
+            if parsed_url.query:
+                path = f"/query_{abs(hash(parsed_url.query)) % 100000}"
+            elif parsed_url.fragment:
+                path = f"/fragment_{abs(hash(parsed_url.fragment)) % 100000}"
+            else:
+                path = f"/resource_{abs(hash(url)) % 100000}"
+        stripped = path.strip('/')
+        path_parts = stripped.split('/') if stripped else ['index']
+        filename = path_parts[-1] if path_parts[-1] not in ('', '.', '..') else 'index'
+        _, dot, extension = filename.rpartition('.')
+        if dot and len(extension) <= 10:
+            extension = extension.lower()
+        else:
+            extension = self.guess_extension(url) or 'bin'
+            filename = f"{filename}.{extension}"
+        folder = self.extensions.get(extension, 'assets')
+        subfolders = [part for part in path_parts[:-1] if part not in ('', '.', '..')]
+        local_path = '/'.join([folder] + subfolders + [filename])
+        return ResourceRecord(url.partition('#')[0], extension, folder, local_path)
+
+class PathAllocator:
+    """Unique archive-relative paths for one capture, allocated in memory.
+
+    paths maps each URL to the path it was given, used holds every name handed
+    out (pages included) so nothing is probed on disk and the HTML rewrite
+    reads the same mapping the downloads were written to.
+    """
+    def __init__(self):
+        self.paths: Dict[str, str] = {}
+        self.used: Set[str] = set()
+        self._next_suffix: Dict[str, int] = {}
+
+    def allocate(self, url, local_path):
+        path = self.paths.get(url)
+        if path is None:
+            path = self.paths[url] = self.reserve(local_path)
+        return path
+
+    def get(self, url):
+        return self.paths.get(url)
+
+    def reserve(self, local_path):
+        """Claims local_path, or the first free <name>_<n><ext> after it"""
+        if local_path not in self.used:
+            self.used.add(local_path)
+            return local_path
+        base, ext = os.path.splitext(local_path)
+        counter = self._next_suffix.get(local_path, 1)
+        while f"{base}_{counter}{ext}" in self.used:
+            counter += 1
+        self._next_suffix[local_path] = counter + 1
+        path = f"{base}_{counter}{ext}"
+        self.used.add(path)
+        return path
+
+class CapturedPage:
+    """One HTML page of a capture, refs, srcsets and links are the attributes rewritten before it is written"""
+    def __init__(self, url, path, document):
+        self.url = url
+        self.path = path
+        self.document = document
+        self.refs = []
+        self.srcsets = []
+        self.links = []
+
 class UrlDownloader:
-    def __init__(self, imgFlg=True, linkFlg=True, scriptFlg=True):
-        self.soup = None
+    def __init__(self, imgFlg=True, linkFlg=True, scriptFlg=True, archive=None, cache=None, parser=None, budget=None):
+        self.document = None
+        self.document_class = HTML_PARSERS.get(parser or HTML_PARSER, SoupDocument)
+        self.archive = archive
+        self.cache = cache
         self.imgFlg = imgFlg
         self.linkFlg = linkFlg
         self.scriptFlg = scriptFlg
@@ -50,157 +1685,298 @@ class UrlDownloader:
             'pdf': 'documents', 'mov': 'media', 'mp4': 'media',
             'webm': 'media', 'ogg': 'media', 'mp3': 'media'
         }
+        self.classifier = ResourceClassifier(self.extensions)
         self.size_limit = 19 * 1024 * 1024
-        self.semaphore = asyncio.Semaphore(25)
+        self.budget = budget or CaptureBudget()
+        self.scheduler = DownloadScheduler(budget=self.budget)
         self.downloaded_files: Set[str] = set()
         self.failed_urls: Set[str] = set()
+        self.canonical_urls: Dict[str, str] = {}
+        self.duplicates_saved = 0
+        self.timings: Dict[str, float] = {}
+        self.cache_hits = 0
+        self.downloaded_count = 0
+        self.bytes_downloaded = 0
+        self.wire_bytes = 0
+        self.manifest: Optional[SiteManifest] = None
+        self.snapshot: Dict[str, Dict] = {}
+        self.revalidated = 0
+        self.refs = []
+        self.pagefolder = ''
+        self.paths = PathAllocator()
+        self.file_paths = []
+        self.stylesheets = []
+        self.pages: Dict[str, CapturedPage] = {}
+        self.scope = None
 
     async def savePage(self, url, pagefolder='page', session=None):
+        return await self.crawl(url, pagefolder, session)
+
+    @contextmanager
+    def stage(self, name):
+        """Adds the time spent in the block to timings[name] and websource_stage_seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            STAGE_SECONDS.observe(elapsed, stage=name)
+
+    async def crawl(self, url, pagefolder='page', session=None, depth=0, max_pages=1, scope='origin'):
+        """Captures url and the in-scope pages it links to, up to depth links away.
+
+        Pages come off one frontier, CRAWL_CONCURRENCY at a time, and share the asset
+        dedup, scheduler and budget. Every page is written next to index.html so asset
+        paths are the same on each page; HTML is written once all assets are in.
+        """
+        self.pagefolder = pagefolder
+        self.scope = self._crawl_scope(url, scope)
+        root, error = await self._fetch_page(url, session)
+        if root is None:
+            return False, error, []
+        self.document = root.document
+        self.refs = root.refs
+        try:
+            frontier = asyncio.Queue()
+            seen = {self._canonical(url)}
+            self._visit(root, 0, frontier, seen, session, depth, max_pages)
+            workers = [
+                asyncio.create_task(self._crawl_worker(frontier, seen, session, depth, max_pages))
+                for _ in range(min(CRAWL_CONCURRENCY, max(max_pages - 1, 1)))
+            ]
+            try:
+                await frontier.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+            with self.stage('assets'):
+                await self.scheduler.join()
+            with self.stage('css'):
+                await self._write_stylesheets()
+
+            file_paths = list(self.file_paths)
+            with self.stage('rewrite'):
+                for page in self.pages.values():
+                    await self._update_html_paths(page, pagefolder)
+                    html_path = os.path.join(pagefolder, page.path)
+                    if hasattr(page.document, 'iter_chunks'):
+                        html_content = page.document.iter_chunks()
+                    else:
+                        html_content = page.document.serialize()
+                    await self._write_file(html_path, html_content, page=True)
+                    file_paths.append(html_path)
+
+            return True, None, file_paths
+        except Exception as e:
+            return False, f"Failed to download: {str(e)}", list(self.file_paths)
+        finally:
+            # Also reached when the capture is cancelled while pages are still coming in
+            self.scheduler.close()
+
+    def _crawl_scope(self, url, scope):
+        """Returns (origin, path prefix) that followed links must match"""
+        parsed = urlparse(url)
+        prefix = parsed.path[:parsed.path.rfind('/') + 1] if scope == 'prefix' else '/'
+        return f"{parsed.scheme}://{parsed.netloc}", prefix or '/'
+
+    def _in_scope(self, url):
+        parsed = urlparse(url)
+        origin, prefix = self.scope
+        return f"{parsed.scheme}://{parsed.netloc}" == origin and (parsed.path or '/').startswith(prefix)
+
+    def _visit(self, page, level, frontier, seen, session, depth, max_pages):
+        """Queues the assets of a fetched page and, below depth, its unseen in-scope links"""
+        self.pages[self._canonical(page.url)] = page
+        with self.stage('extract'):
+            resource_urls = self._extract_resources(page)
+        for resource_url in resource_urls:
+            if self._is_valid_url(resource_url):
+                self._queue_resource(resource_url, session)
+        if level >= depth:
+            return
+        for _, _, link_url, _ in page.links:
+            if len(seen) >= max_pages:
+                break
+            key = self._canonical(link_url)
+            if key not in seen and self._in_scope(link_url):
+                seen.add(key)
+                frontier.put_nowait((link_url, level + 1))
+
+    async def _crawl_worker(self, frontier, seen, session, depth, max_pages):
+        while True:
+            link_url, level = await frontier.get()
+            try:
+                if self.budget.admit():
+                    page, _ = await self._fetch_page(link_url, session)
+                    if page is not None:
+                        self._visit(page, level, frontier, seen, session, depth, max_pages)
+            except Exception:
+                pass
+            finally:
+                frontier.task_done()
+
+    def _page_path(self, url):
+        """Archive name for a crawled page: index.html for the first, a slug of the URL path after that"""
+        if not self.pages:
+            name = 'index'
+        else:
+            parsed = urlparse(url)
+            name = re.sub(r'\.html?$', '', parsed.path.strip('/'), flags=re.IGNORECASE)
+            name = re.sub(r'[^\w.-]+', '_', name).strip('_.') or 'page'
+            if parsed.query:
+                name = f"{name}_{hashlib.md5(parsed.query.encode()).hexdigest()[:8]}"
+        return self.paths.reserve(f"{name}.html")
+
+    async def _fetch_page(self, url, session):
+        """Fetches and parses one HTML page, returns (CapturedPage, None) or (None, error)"""
         try:
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
                 'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
                 'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'identity',
+                'Accept-Encoding': accept_encoding(),
                 'Cache-Control': 'no-cache',
                 'Connection': 'keep-alive'
             }
 
-            async with session.get(url, timeout=20, headers=headers, allow_redirects=True) as response:
-                if response.status != 200:
-                    return False, f"HTTP error {response.status}", []
+            with self.stage('html_fetch'):
+                async with session.get(url, timeout=20, headers=headers, allow_redirects=True) as response:
+                    if response.status != 200:
+                        return None, f"HTTP error {response.status}"
 
-                content = await response.read()
-                if len(content) > self.size_limit or len(content) == 0:
-                    return False, "Size limit exceeded or empty content", []
+                    # Checked before the body is read, crawls follow links to PDFs and archives too
+                    content_type = response.headers.get('content-type', '').lower()
+                    if not any(ct in content_type for ct in ['text/html', 'application/xhtml', 'text/xml']):
+                        return None, f"Invalid content type: {content_type}"
 
-                content_type = response.headers.get('content-type', '').lower()
-                if not any(ct in content_type for ct in ['text/html', 'application/xhtml', 'text/xml']):
-                    return False, f"Invalid content type: {content_type}", []
+                    content = await self._read_limited(response)
+                    if not content:
+                        return None, "Size limit exceeded or empty content"
+                    self.budget.charge(len(content))
 
+            with self.stage('parse'):
                 try:
-                    self.soup = BeautifulSoup(content, features="lxml")
-                except:
-                    try:
-                        self.soup = BeautifulSoup(content, features="html.parser")
-                    except Exception as e:
-                        return False, f"Failed to parse HTML: {str(e)}", []
-
-            os.makedirs(pagefolder, exist_ok=True)
-            file_paths = []
-            all_resource_urls = set()
-
-            if self.linkFlg:
-                all_resource_urls.update(self._extract_css_resources(url))
-            if self.scriptFlg:
-                all_resource_urls.update(self._extract_js_resources(url))
-            if self.imgFlg:
-                all_resource_urls.update(self._extract_image_resources(url))
-
-            all_resource_urls.update(self._extract_other_resources(url))
-            all_resource_urls.update(self._extract_inline_urls(str(self.soup), url))
-            all_resource_urls.update(self._extract_meta_resources(url))
-            all_resource_urls = [u for u in all_resource_urls if u and self._is_valid_url(u)]
-
-            if all_resource_urls:
-                downloaded_resources = await self._download_all_resources(list(all_resource_urls), pagefolder, session)
-                file_paths.extend(downloaded_resources)
-
-            await self._update_html_paths(url, pagefolder)
-
-            html_path = os.path.join(pagefolder, 'index.html')
-            html_content = self.soup.prettify('utf-8')
-            async with aiofiles.open(html_path, 'wb') as file:
-                await file.write(html_content)
-            file_paths.append(html_path)
+                    document = self.document_class(content, content_type)
+                except Exception as e:
+                    return None, f"Failed to parse HTML: {str(e)}"
 
-            return True, None, file_paths
+            return CapturedPage(url, self._page_path(url), document), None
         except asyncio.TimeoutError:
-            return False, "Request timed out", []
+            return None, "Request timed out"
         except Exception as e:
-            return False, f"Failed to download: {str(e)}", []
+            return None, f"Failed to download: {str(e)}"
+
+    def progress(self):
+        return {
+            "pages_captured": len(self.pages),
+            "assets_discovered": len(self.downloaded_files),
+            "assets_downloaded": self.downloaded_count,
+            "assets_failed": len(self.failed_urls),
+            "duplicates_saved": self.duplicates_saved,
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_on_wire": self.wire_bytes,
+            "skipped_files": self.budget.skipped,
+            "queued": self.scheduler.queued,
+            "in_flight": self.scheduler.in_flight
+        }
 
     def _is_valid_url(self, url):
         if not url or not isinstance(url, str):
             return False
         return not url.startswith(('data:', 'blob:', 'javascript:', 'mailto:', 'tel:', '#', 'about:'))
 
-    def _extract_css_resources(self, base_url):
-        urls = set()
-        if self.soup is None:
-            return urls
-        for link in self.soup.find_all('link', href=True):
-            rel = link.get('rel', [])
-            if isinstance(rel, str):
-                rel = [rel]
-            if 'stylesheet' in rel or link.get('type') == 'text/css':
-                href = link.get('href')
-                if href:
-                    urls.add(urljoin(base_url, href.strip()))
-        for style in self.soup.find_all('style'):
-            if style.string:
-                urls.update(self._extract_css_urls(style.string, base_url))
-        return urls
-
-    def _extract_js_resources(self, base_url):
-        urls = set()
-        if self.soup is None:
-            return urls
-        for script in self.soup.find_all('script', src=True):
-            src = script.get('src')
-            if src:
-                urls.add(urljoin(base_url, src.strip()))
-        return urls
-
-    def _extract_image_resources(self, base_url):
-        urls = set()
-        if self.soup is None:
-            return urls
-        for img in self.soup.find_all('img'):
-            if img.get('src'):
-                urls.add(urljoin(base_url, img.get('src').strip()))
-            if img.get('data-src'):
-                urls.add(urljoin(base_url, img.get('data-src').strip()))
-            if img.get('srcset'):
-                urls.update(self._parse_srcset(img.get('srcset'), base_url))
-        for source in self.soup.find_all('source'):
-            if source.get('src'):
-                urls.add(urljoin(base_url, source.get('src').strip()))
-            if source.get('srcset'):
-                urls.update(self._parse_srcset(source.get('srcset'), base_url))
-        return urls
-
-    def _extract_other_resources(self, base_url):
-        urls = set()
-        if self.soup is None:
-            return urls
-        for link in self.soup.find_all('link', href=True):
-            rel = link.get('rel', [])
-            if isinstance(rel, str):
-                rel = [rel]
-            if any(r in rel for r in ['icon', 'shortcut icon', 'apple-touch-icon', 'manifest', 'alternate', 'canonical', 'preload', 'prefetch']):
-                href = link.get('href')
-                if href:
-                    urls.add(urljoin(base_url, href.strip()))
-        for tag in self.soup.find_all(['audio', 'video', 'embed'], src=True):
-            urls.add(urljoin(base_url, tag.get('src').strip()))
-        for obj in self.soup.find_all('object', data=True):
-            urls.add(urljoin(base_url, obj.get('data').strip()))
-        return urls
+    def _extract_resources(self, page):
+        """Collects every resource URL of page in one walk over its tree.
 
-    def _extract_meta_resources(self, base_url):
+        The (tag, attribute, url) references that _update_html_paths rewrites
+        are kept in page.refs, srcset attributes in page.srcsets and <a href>
+        targets in page.links, so the rewrite does not search the tree again.
+        """
         urls = set()
-        if self.soup is None:
-            return urls
-        for meta in self.soup.find_all('meta'):
-            content = meta.get('content', '')
-            if content and (content.startswith(('http://', 'https://', '/')) or '.' in content):
+        base_url = page.url
+        document = page.document
+        for tag, name, attrs in document.elements():
+            if name == 'a':
+                href = attrs.get('href')
+                if href and not href.startswith('#'):
+                    link_url, fragment = urldefrag(urljoin(base_url, href.strip()))
+                    if link_url.startswith(('http://', 'https://')):
+                        page.links.append((tag, 'href', link_url, fragment))
+            elif name == 'link':
+                href = attrs.get('href')
+                if not href:
+                    continue
+                href_url = urljoin(base_url, href.strip())
+                self._add_ref(page, tag, 'href', href_url)
+                rel = attrs.get('rel', [])
+                if isinstance(rel, str):
+                    rel = rel.lower().split()
+                if self.linkFlg and ('stylesheet' in rel or attrs.get('type') == 'text/css'):
+                    urls.add(href_url)
+                if any(r in rel for r in LINK_RESOURCE_RELS):
+                    urls.add(href_url)
+            elif name == 'script':
+                src = attrs.get('src')
+                if src:
+                    src_url = urljoin(base_url, src.strip())
+                    self._add_ref(page, tag, 'src', src_url)
+                    if self.scriptFlg:
+                        urls.add(src_url)
+                else:
+                    text = document.text(tag)
+                    if text:
+                        urls.update(self._extract_script_urls(text, base_url))
+            elif name == 'style':
+                text = document.text(tag)
+                if text:
+                    urls.update(self._extract_css_urls(text, base_url))
+            elif name == 'img':
+                src = attrs.get('src')
+                if src:
+                    src_url = urljoin(base_url, src.strip())
+                    self._add_ref(page, tag, 'src', src_url)
+                    if self.imgFlg:
+                        urls.add(src_url)
+                if attrs.get('srcset'):
+                    page.srcsets.append((tag, attrs.get('srcset')))
+                if self.imgFlg:
+                    if attrs.get('data-src'):
+                        urls.add(urljoin(base_url, attrs.get('data-src').strip()))
+                    if attrs.get('srcset'):
+                        urls.update(self._parse_srcset(attrs.get('srcset'), base_url))
+            elif name == 'source':
+                if attrs.get('src'):
+                    src_url = urljoin(base_url, attrs.get('src').strip())
+                    self._add_ref(page, tag, 'src', src_url)
+                    if self.imgFlg:
+                        urls.add(src_url)
+                if attrs.get('srcset'):
+                    page.srcsets.append((tag, attrs.get('srcset')))
+                    if self.imgFlg:
+                        urls.update(self._parse_srcset(attrs.get('srcset'), base_url))
+            elif name in ('audio', 'video', 'embed'):
+                if attrs.get('src'):
+                    src_url = urljoin(base_url, attrs.get('src').strip())
+                    self._add_ref(page, tag, 'src', src_url)
+                    urls.add(src_url)
+            elif name == 'object':
+                if attrs.get('data'):
+                    data_url = urljoin(base_url, attrs.get('data').strip())
+                    self._add_ref(page, tag, 'data', data_url)
+                    urls.add(data_url)
+            elif name == 'meta':
+                content = attrs.get('content', '')
                 if content.startswith('/'):
                     urls.add(urljoin(base_url, content))
                 elif content.startswith(('http://', 'https://')):
                     urls.add(content)
         return urls
 
+    def _add_ref(self, page, tag, attr, resource_url):
+        if self._is_valid_url(resource_url):
+            page.refs.append((tag, attr, resource_url))
+
     def _parse_srcset(self, srcset, base_url):
         urls = set()
         if not srcset:
@@ -215,191 +1991,326 @@ class UrlDownloader:
 
     def _extract_css_urls(self, css_content, base_url):
         urls = set()
-        url_pattern = r'url\s*\(\s*["\']?([^"\'()]+)["\']?\s*\)'
-        for css_url in re.findall(url_pattern, css_content, re.IGNORECASE):
-            if not css_url.startswith(('data:', 'blob:', 'javascript:')):
-                urls.add(urljoin(base_url, css_url.strip()))
-        import_pattern = r'@import\s+["\']([^"\']+)["\']'
-        for import_url in re.findall(import_pattern, css_content, re.IGNORECASE):
-            urls.add(urljoin(base_url, import_url.strip()))
+        for match in CSS_REF_RE.finditer(css_content):
+            css_url = (match.group(2) if match.group(1) is not None else match.group(4)).strip()
+            if css_url and not css_url.startswith(('data:', 'blob:', 'javascript:', '#')):
+                urls.add(urljoin(base_url, css_url))
+        return urls
+
+    def _extract_script_urls(self, script_content, base_url):
+        urls = set()
+        for js_url in SCRIPT_URL_RE.findall(script_content):
+            if js_url and not js_url.startswith(('data:', 'blob:', 'javascript:')):
+                urls.add(urljoin(base_url, js_url.strip()))
         return urls
 
-    def _extract_inline_urls(self, html_content, base_url):
-        urls = set()
-        style_blocks = re.findall(r'<style[^>]*>(.*?)</style>', html_content, re.DOTALL | re.IGNORECASE)
-        for style_block in style_blocks:
-            urls.update(self._extract_css_urls(style_block, base_url))
-        script_blocks = re.findall(r'<script[^>]*>(.*?)</script>', html_content, re.DOTALL | re.IGNORECASE)
-        for script_block in script_blocks:
-            js_urls = re.findall(r'["\']([^"\']*\.(js|css|png|jpg|jpeg|gif|svg|woff2?|ttf|eot|json|xml))["\']', script_block, re.IGNORECASE)
-            for js_url_match in js_urls:
-                js_url = js_url_match[0]
-                if js_url and not js_url.startswith(('data:', 'blob:', 'javascript:')):
-                    urls.add(urljoin(base_url, js_url.strip()))
-        return urls
+    def _queue_resource(self, resource_url, session):
+        """Schedules resource_url once per capture and returns its local file path"""
+        first_sighting = resource_url not in self.canonical_urls
+        key = self._canonical(resource_url)
+        if key in self.failed_urls:
+            return None
+        if key in self.downloaded_files:
+            if first_sighting:
+                self.duplicates_saved += 1
+            local_path = self.paths.get(key)
+            return os.path.join(self.pagefolder, local_path) if local_path else None
+        self.downloaded_files.add(key)
+        file_path = self._get_resource_path(resource_url, self.pagefolder)
+        if file_path:
+            self.file_paths.append(file_path)
+            self.scheduler.submit(
+                urlparse(resource_url).netloc,
+                partial(self._download_single_resource, resource_url, file_path, session),
+                self._priority(resource_url),
+                partial(self.failed_urls.add, key)
+            )
+        return file_path
+
+    def _canonical(self, url):
+        canonical = self.canonical_urls.get(url)
+        if canonical is None:
+            canonical = self.canonical_urls[url] = canonicalize_url(url)
+        return canonical
+
+    def _priority(self, resource_url):
+        return ASSET_PRIORITIES.get(self.classifier.classify(resource_url).folder, 1)
+
+    def _get_resource_path(self, resource_url, pagefolder):
+        try:
+            local_path = self.paths.allocate(self._canonical(resource_url), self.classifier.classify(resource_url).local_path)
+            return os.path.join(pagefolder, local_path)
+        except:
+            return None
+
+    async def _write_file(self, file_path, content, page=False):
+        """Writes bytes, or an iterable of byte chunks, to the page folder or the archive"""
+        if self.archive is not None:
+            if not isinstance(content, bytes):
+                content = b''.join(content)
+            self.archive.add(file_path, content, page)
+            return
+        await run_blocking(os.makedirs, os.path.dirname(file_path) or '.', exist_ok=True)
+        async with aiofiles.open(file_path, 'wb') as file:
+            if isinstance(content, bytes):
+                await file.write(content)
+            else:
+                for chunk in content:
+                    await file.write(chunk)
+
+    async def _download_single_resource(self, resource_url, file_path, session):
+        sink = self._open_sink(file_path)
+        try:
+            if not await self._fetch_resource(resource_url, session, sink) or sink.size == 0:
+                await self._discard(sink)
+                self.failed_urls.add(self._canonical(resource_url))
+                return False
+            size = sink.size
+            if isinstance(sink, MemorySink):
+                with self.stage('css'):
+                    css_content = sink.data.decode('utf-8', errors='ignore')
+                    sink.data = bytearray()
+                    self._queue_css_refs(css_content, resource_url, session)
+                    self.stylesheets.append((resource_url, file_path, css_content))
+            else:
+                await sink.commit()
+            record = self.snapshot.get(self._canonical(resource_url))
+            if record is not None:
+                record["path"] = os.path.relpath(file_path, self.pagefolder)
+                record["size"] = size
+            self.downloaded_count += 1
+            self.bytes_downloaded += size
+            return True
+        except Exception:
+            await self._discard(sink)
+            self.failed_urls.add(self._canonical(resource_url))
+            return False
+
+    def _open_sink(self, file_path):
+        if file_path.endswith('.css'):
+            return MemorySink()
+        if self.archive is not None:
+            return SpoolSink(self.archive, file_path)
+        return FileSink(file_path)
+
+    async def _discard(self, sink):
+        self.budget.release(sink.size)
+        await sink.abort()
+
+    def _over_limit(self, current_size, incoming):
+        return current_size + incoming > self.size_limit or not self.budget.fits(incoming)
+
+    async def _accept(self, sink, chunk):
+        """Adds chunk to sink unless it passes the per-file limit or the capture budget"""
+        if self._over_limit(sink.size, len(chunk)):
+            self.budget.skipped += 1
+            return False
+        self.budget.charge(len(chunk))
+        await sink.write(chunk)
+        return True
+
+    def _remember(self, resource_url, digest, etag, last_modified):
+        """Records what an incremental capture needs for the next manifest"""
+        if self.manifest is not None:
+            self.snapshot[self._canonical(resource_url)] = {"hash": digest, "etag": etag, "last_modified": last_modified}
+
+    def _received(self, chunk):
+        BYTES_IN.inc(len(chunk))
+        self.wire_bytes += len(chunk)
 
-    async def _download_all_resources(self, resource_urls, pagefolder, session):
-        tasks = []
-        file_paths = []
-        for resource_url in resource_urls:
-            if resource_url not in self.downloaded_files and resource_url not in self.failed_urls:
-                self.downloaded_files.add(resource_url)
-                file_path = self._get_resource_path(resource_url, pagefolder)
-                if file_path:
-                    file_paths.append(file_path)
-                    tasks.append(self._download_single_resource(resource_url, file_path, session))
-        if tasks:
-            batch_size = 25
-            for i in range(0, len(tasks), batch_size):
-                await asyncio.gather(*tasks[i:i+batch_size], return_exceptions=True)
-                await asyncio.sleep(0.2)
-        return file_paths
+    async def _decoded(self, response):
+        """Yields the decoded body of response in pieces of at most DOWNLOAD_CHUNK_SIZE"""
+        decoder = BodyDecoder.for_response(response)
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            self._received(chunk)
+            for piece in decoder.decode(chunk):
+                yield piece
+        for piece in decoder.finish():
+            yield piece
 
-    def _get_resource_path(self, resource_url, pagefolder):
+    async def _read_limited(self, response):
+        """Reads and decodes a response body in chunks, None once it passes the size limit"""
+        if response.content_length is not None and response.content_length > self.size_limit:
+            return None
+        content = bytearray()
+        async for piece in self._decoded(response):
+            content += piece
+            if len(content) > self.size_limit:
+                return None
+        return bytes(content)
+
+    async def _copy_cached(self, entry, sink):
+        """Streams a cached body into sink; None when the cached object is gone"""
         try:
-            parsed_url = urlparse(resource_url)
-            path = unquote(parsed_url.path)
-            if not path or path == '/':
-                query = parsed_url.query
-                fragment = parsed_url.fragment
-                if query:
-                    path = f"/query_{abs(hash(query)) % 100000}"
-                elif fragment:
-                    path = f"/fragment_{abs(hash(fragment)) % 100000}"
-                else:
-                    path = f"/resource_{abs(hash(resource_url)) % 100000}"
-            path_parts = path.strip('/').split('/') if path.strip('/') else ['index']
-            filename = path_parts[-1] if path_parts[-1] else 'index'
-            if '.' in filename and len(filename.split('.')[-1]) <= 10:
-                file_ext = filename.split('.')[-1].lower()
-            else:
-                file_ext = self._guess_extension_from_url(resource_url)
-                if file_ext:
-                    filename = f"{filename}.{file_ext}"
-                else:
-                    filename = f"{filename}.html"
-                file_ext = file_ext or 'html'
-            folder_name = self.extensions.get(file_ext, 'assets')
-            if len(path_parts) > 1:
-                subfolder_path = '/'.join(path_parts[:-1])
-                target_folder = os.path.join(pagefolder, folder_name, subfolder_path)
-            else:
-                target_folder = os.path.join(pagefolder, folder_name)
-            os.makedirs(target_folder, exist_ok=True)
-            counter = 1
-            base_filename = filename
-            while True:
-                full_path = os.path.join(target_folder, filename)
-                if not os.path.exists(full_path):
-                    break
-                name, ext = os.path.splitext(base_filename)
-                filename = f"{name}_{counter}{ext}"
-                counter += 1
-            return full_path
-        except:
+            async with aiofiles.open(entry.get("object_path") or self.cache.object_path(entry), 'rb') as file:
+                while True:
+                    chunk = await file.read(DOWNLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        return True
+                    if not await self._accept(sink, chunk):
+                        return False
+        except OSError:
             return None
 
-    def _guess_extension_from_url(self, url):
-        url_lower = url.lower()
-        if any(kw in url_lower for kw in ['css', 'style']):
-            return 'css'
-        elif any(kw in url_lower for kw in ['js', 'javascript', 'script']):
-            return 'js'
-        elif any(ext in url_lower for ext in ['png', 'jpg', 'jpeg', 'gif', 'svg', 'webp', 'ico', 'avif']):
-            for ext in ['png', 'jpg', 'jpeg', 'gif', 'svg', 'webp', 'ico', 'avif']:
-                if ext in url_lower:
-                    return ext
-        elif any(ext in url_lower for ext in ['woff2', 'woff', 'ttf', 'otf', 'eot']):
-            for ext in ['woff2', 'woff', 'ttf', 'otf', 'eot']:
-                if ext in url_lower:
-                    return ext
-        elif 'json' in url_lower or 'manifest' in url_lower:
-            return 'json'
-        elif 'xml' in url_lower:
-            return 'xml'
-        return None
+    async def _fetch_resource(self, resource_url, session, sink):
+        """Streams the resource from the asset cache or the network into sink, False on failure"""
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            ok, status = await self._transfer(resource_url, session, sink)
+            return ok
+        finally:
+            ASSET_SECONDS.observe(time.perf_counter() - started, host=host_label(resource_url), status=status)
 
-    async def _download_single_resource(self, resource_url, file_path, session):
-        async with self.semaphore:
+    async def _transfer(self, resource_url, session, sink):
+        """Does the work of _fetch_resource, returns (ok, status label)"""
+        entry = self.cache.lookup(resource_url) if self.cache is not None else None
+        if entry is None and self.manifest is not None and self.cache is not None:
+            entry = self.manifest.cache_entry(self._canonical(resource_url))
+        if entry is not None and self.cache.is_fresh(entry):
+            copied = await self._copy_cached(entry, sink)
+            if copied:
+                self.cache.hits += 1
+                self.cache_hits += 1
+                self._remember(resource_url, entry["hash"], entry.get("etag"), entry.get("last_modified"))
+                return True, 'cache'
+            if copied is not None:
+                return False, 'cache'
+            await self.cache.discard(resource_url)
+            entry = None
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': '*/*',
+            'Accept-Encoding': accept_encoding(),
+            'Cache-Control': 'no-cache',
+            'Referer': resource_url
+        }
+        if entry is not None:
+            headers.update(self.cache.conditional_headers(entry))
+        async with session.get(resource_url, timeout=15, headers=headers, allow_redirects=True) as response:
+            if response.status == 304 and entry is not None:
+                copied = await self._copy_cached(entry, sink)
+                if copied is None:
+                    await self.cache.discard(resource_url)
+                    return False, '304'
+                if copied:
+                    await self.cache.refresh(resource_url, response.headers)
+                    self.cache.revalidations += 1
+                    self.cache_hits += 1
+                    self.revalidated += 1
+                    self._remember(
+                        resource_url, entry["hash"],
+                        response.headers.get('etag') or entry.get("etag"),
+                        response.headers.get('last-modified') or entry.get("last_modified")
+                    )
+                return copied, '304'
+            status = str(response.status)
+            if response.status not in [200, 206]:
+                return False, status
+            if response.content_length is not None and self._over_limit(0, response.content_length):
+                self.budget.skipped += 1
+                return False, status
+            writer = None
+            if self.cache is not None and response.status == 200:
+                writer = self.cache.begin(resource_url, response.headers)
+            # The cache writer already hashes the body, incremental captures without one hash it here
+            hasher = hashlib.sha256() if writer is None and self.manifest is not None else None
             try:
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    'Accept': '*/*',
-                    'Accept-Encoding': 'identity',
-                    'Cache-Control': 'no-cache',
-                    'Referer': resource_url
-                }
-                async with session.get(resource_url, timeout=15, headers=headers, allow_redirects=True) as response:
-                    if response.status not in [200, 206]:
-                        self.failed_urls.add(resource_url)
-                        return False
-                    content = await response.read()
-                    if len(content) > self.size_limit or len(content) == 0:
-                        self.failed_urls.add(resource_url)
-                        return False
-                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                    if file_path.endswith('.css'):
-                        try:
-                            decoded_content = content.decode('utf-8', errors='ignore')
-                            processed_content = await self._process_css_content(decoded_content, resource_url, session)
-                            content = processed_content.encode('utf-8')
-                        except:
-                            pass
-                    async with aiofiles.open(file_path, 'wb') as file:
-                        await file.write(content)
-                    return True
-            except:
-                self.failed_urls.add(resource_url)
-                return False
+                async for piece in self._decoded(response):
+                    if not await self._accept(sink, piece):
+                        if writer is not None:
+                            await writer.abort()
+                        return False, status
+                    if writer is not None:
+                        await writer.write(piece)
+                    elif hasher is not None:
+                        hasher.update(piece)
+            except BaseException:
+                if writer is not None:
+                    await writer.abort()
+                raise
+            if writer is not None:
+                self.cache.misses += 1
+                await writer.commit()
+            if self.manifest is not None:
+                self._remember(
+                    resource_url, (writer.hasher if writer is not None else hasher).hexdigest(),
+                    response.headers.get('etag'), response.headers.get('last-modified')
+                )
+            return True, status
 
-    async def _process_css_content(self, css_content, base_url, session):
-        def replace_url(match):
-            url = match.group(1).strip('\'"')
-            if not url.startswith(('data:', 'http://', 'https://')):
-                return f'url("{urljoin(base_url, url)}")'
-            return match.group(0)
-        return re.sub(r'url\s*\(\s*["\']?([^"\'()]+)["\']?\s*\)', replace_url, css_content)
+    def _css_refs(self, css_content, base_url):
+        """Yields (match, is_import, ref, absolute url without fragment, fragment) per url()/@import"""
+        for match in CSS_REF_RE.finditer(css_content):
+            is_import = match.group(1) is not None
+            ref = (match.group(2) if is_import else match.group(4)).strip()
+            if not ref or ref.startswith(('data:', 'blob:', 'javascript:', '#')):
+                continue
+            resource_url, fragment = urldefrag(urljoin(base_url, ref))
+            yield match, is_import, ref, resource_url, fragment
 
-    async def _update_html_paths(self, base_url, pagefolder):
-        if self.soup is None:
-            return
-        for img_tag in self.soup.find_all('img'):
-            if img_tag.get('src'):
-                local_path = self._get_local_path(urljoin(base_url, img_tag.get('src')), pagefolder)
-                if local_path:
-                    img_tag['src'] = local_path
-        for link_tag in self.soup.find_all('link'):
-            if link_tag.get('href'):
-                local_path = self._get_local_path(urljoin(base_url, link_tag.get('href')), pagefolder)
-                if local_path:
-                    link_tag['href'] = local_path
-        for script_tag in self.soup.find_all('script'):
-            if script_tag.get('src'):
-                local_path = self._get_local_path(urljoin(base_url, script_tag.get('src')), pagefolder)
-                if local_path:
-                    script_tag['src'] = local_path
+    def _queue_css_refs(self, css_content, base_url, session):
+        for _, _, _, resource_url, _ in self._css_refs(css_content, base_url):
+            if self._is_valid_url(resource_url):
+                self._queue_resource(resource_url, session)
 
-    def _get_local_path(self, resource_url, pagefolder):
-        try:
-            parsed_url = urlparse(resource_url)
-            path = unquote(parsed_url.path)
-            if not path or path == '/':
-                return None
-            path_parts = path.strip('/').split('/') if path.strip('/') else ['index']
-            filename = path_parts[-1] if path_parts[-1] else 'index'
-            if '.' in filename and len(filename.split('.')[-1]) <= 10:
-                file_ext = filename.split('.')[-1].lower()
-            else:
-                file_ext = self._guess_extension_from_url(resource_url) or 'html'
-                filename = f"{filename}.{file_ext}"
-            folder_name = self.extensions.get(file_ext, 'assets')
-            if len(path_parts) > 1:
-                subfolder = '/'.join(path_parts[:-1])
-                return f"{folder_name}/{subfolder}/{filename}"
+    async def _write_stylesheets(self):
+        """Writes the downloaded stylesheets once every download has settled, so
+        references to assets that failed keep their absolute URL"""
+        for resource_url, file_path, css_content in self.stylesheets:
+            try:
+                await self._write_file(file_path, self._rewrite_css(css_content, resource_url, file_path))
+            except Exception:
+                key = self._canonical(resource_url)
+                self.failed_urls.add(key)
+                self.snapshot.pop(key, None)
+        self.stylesheets = []
+
+    def _rewrite_css(self, css_content, base_url, css_path):
+        """Yields the stylesheet in chunks with its url()/@import targets pointed at
+        their local copies, relative to css_path"""
+        css_dir = os.path.dirname(css_path) or '.'
+        position = 0
+        for match, is_import, ref, resource_url, fragment in self._css_refs(css_content, base_url):
+            local_path = self._get_local_path(resource_url, self.pagefolder)
+            if local_path and self._canonical(resource_url) not in self.failed_urls:
+                target = os.path.relpath(os.path.join(self.pagefolder, local_path), css_dir).replace(os.sep, '/')
+                if fragment:
+                    target = f"{target}#{fragment}"
             else:
-                return f"{folder_name}/{filename}"
-        except:
-            return None
+                target = urljoin(base_url, ref)
+            yield css_content[position:match.start()].encode('utf-8')
+            yield (f'@import "{target}"' if is_import else f'url("{target}")').encode('utf-8')
+            position = match.end()
+        yield css_content[position:].encode('utf-8')
+
+    async def _update_html_paths(self, page, pagefolder):
+        """Points refs and links at their archived copies, everything not captured at its absolute URL"""
+        for tag, attr, resource_url in page.refs:
+            page.document.set_attr(tag, attr, self._archived_url(resource_url, pagefolder))
+        for tag, srcset in page.srcsets:
+            candidates = []
+            for entry in srcset.split(','):
+                parts = entry.split()
+                if parts:
+                    parts[0] = self._archived_url(urljoin(page.url, parts[0]), pagefolder)
+                    candidates.append(' '.join(parts))
+            page.document.set_attr(tag, 'srcset', ', '.join(candidates))
+        for tag, attr, link_url, fragment in page.links:
+            target = self.pages.get(self._canonical(link_url))
+            path = target.path if target is not None else link_url
+            page.document.set_attr(tag, attr, f"{path}#{fragment}" if fragment else path)
+
+    def _archived_url(self, resource_url, pagefolder):
+        """Local path of a downloaded resource, its absolute URL if it failed or was never queued"""
+        local_path = self._get_local_path(resource_url, pagefolder)
+        if local_path and self._canonical(resource_url) not in self.failed_urls:
+            return local_path
+        return resource_url
+
+    def _get_local_path(self, resource_url, pagefolder):
+        """Page-relative path the resource was allocated, None if it was never queued"""
+        return self.paths.get(self._canonical(resource_url))
 
 class DirectSourceFetcher:
     def __init__(self):
@@ -608,13 +2519,34 @@ class DirectSourceFetcher:
                 await self.session.aclose()
                 self.session = None
 
-def create_zip(folder_path):
+def sample_entropy(sample):
+    """Shannon entropy of a byte sample in bits per byte"""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in Counter(sample).values())
+
+def choose_compression(name, sample=b''):
+    """Returns (compress_type, compresslevel) for an archive member"""
+    ext = os.path.splitext(name)[1][1:].lower()
+    if ext in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED, None
+    if ext in DEFLATE_EXTENSIONS:
+        return zipfile.ZIP_DEFLATED, ZIP_DEFLATE_LEVEL
+    if sample_entropy(sample[:4096]) > 7.5:
+        return zipfile.ZIP_STORED, None
+    return zipfile.ZIP_DEFLATED, ZIP_DEFLATE_LEVEL
+
+def create_zip(folder_path, stats=None, max_bytes=CAPTURE_MAX_BYTES, pages=()):
+    """Zips folder_path into BASE_DIR; stats, if given, receives sizes and timing.
+    Files past max_bytes are left out, the captured pages (archive names in pages) are always kept"""
     try:
         if not os.path.exists(folder_path):
             return None
+        started = time.perf_counter()
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.zip', dir=BASE_DIR)
         temp_file.close()
-        with zipfile.ZipFile(temp_file.name, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zip_file:
+        with zipfile.ZipFile(temp_file.name, 'w', zipfile.ZIP_DEFLATED, compresslevel=ZIP_DEFLATE_LEVEL) as zip_file:
             file_count = 0
             total_size = 0
             for root, _, files in os.walk(folder_path):
@@ -623,10 +2555,15 @@ def create_zip(folder_path):
                         file_path = os.path.join(root, file)
                         if os.path.exists(file_path):
                             file_size = os.path.getsize(file_path)
-                            if total_size + file_size > 19 * 1024 * 1024:
-                                continue
                             arc_name = os.path.relpath(file_path, folder_path)
-                            zip_file.write(file_path, arc_name)
+                            if total_size + file_size > max_bytes and arc_name not in pages:
+                                continue
+                            sample = b''
+                            if os.path.splitext(file)[1][1:].lower() not in STORED_EXTENSIONS | DEFLATE_EXTENSIONS:
+                                with open(file_path, 'rb') as f:
+                                    sample = f.read(4096)
+                            compress_type, level = choose_compression(file, sample)
+                            zip_file.write(file_path, arc_name, compress_type=compress_type, compresslevel=level)
                             file_count += 1
                             total_size += file_size
                     except:
@@ -634,28 +2571,509 @@ def create_zip(folder_path):
             if file_count == 0:
                 os.unlink(temp_file.name)
                 return None
+        if stats is not None:
+            stats["file_count"] = file_count
+            stats["raw_bytes"] = total_size
+            stats["zip_bytes"] = os.path.getsize(temp_file.name)
+            stats["seconds"] = time.perf_counter() - started
         return temp_file.name
     except:
         return None
 
-def clean_expired_files():
-    while True:
-        time.sleep(30)
+class _ChunkBuffer:
+    """Write-only sink for ZipFile; it has no seek/tell so zipfile emits data descriptors."""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class ZipStreamWriter:
+    """Builds a ZIP archive on the fly, members are queued by UrlDownloader as downloads finish."""
+    def __init__(self, size_limit=CAPTURE_MAX_BYTES):
+        self.size_limit = size_limit
+        self.file_count = 0
+        self.total_size = 0
+        self.started = asyncio.Event()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._buffer = _ChunkBuffer()
+        self._zip = zipfile.ZipFile(self._buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=ZIP_DEFLATE_LEVEL)
+        self.zip_bytes = 0
+        self.zip_seconds = 0.0
+
+    def add(self, arcname, content, page=False):
+        """Queues a member; pages are kept past size_limit, every other member is dropped there"""
+        self._queue.put_nowait((arcname, content, page))
+        self.started.set()
+
+    def close(self):
+        self._queue.put_nowait(None)
+        self.started.set()
+
+    def _write_member(self, arcname, source, compress_type, level):
+        """Copies a file-like member into the archive in chunks"""
+        compression, compresslevel = self._zip.compression, self._zip.compresslevel
+        self._zip.compression, self._zip.compresslevel = compress_type, level
+        try:
+            with self._zip.open(arcname, 'w') as dest:
+                shutil.copyfileobj(source, dest, DOWNLOAD_CHUNK_SIZE)
+        finally:
+            self._zip.compression, self._zip.compresslevel = compression, compresslevel
+            source.close()
+
+    async def stream(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            arcname, content, page = item
+            if isinstance(content, bytes):
+                size, sample = len(content), content[:4096]
+            else:
+                size = content.seek(0, os.SEEK_END)
+                content.seek(0)
+                sample = content.read(4096)
+                content.seek(0)
+            if self.total_size + size > self.size_limit and not page:
+                if not isinstance(content, bytes):
+                    content.close()
+                continue
+            compress_type, level = choose_compression(arcname, sample)
+            started = time.perf_counter()
+            try:
+                if isinstance(content, bytes):
+                    await run_archive(self._zip.writestr, arcname, content, compress_type=compress_type, compresslevel=level)
+                else:
+                    await run_archive(self._write_member, arcname, content, compress_type, level)
+            except:
+                continue
+            self.zip_seconds += time.perf_counter() - started
+            self.file_count += 1
+            self.total_size += size
+            chunk = self._buffer.drain()
+            if chunk:
+                self.zip_bytes += len(chunk)
+                yield chunk
+        self._zip.close()
+        chunk = self._buffer.drain()
+        self.zip_bytes += len(chunk)
+        yield chunk
+
+def discard_files(file_paths, folder=None):
+    for fp in file_paths:
+        try:
+            os.remove(fp)
+        except:
+            pass
+    if folder:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def disk_usage(path):
+    """Bytes allocated under path, like du -s"""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += disk_usage(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_blocks * 512
+        except OSError:
+            continue
+    return total
+
+def remove_artifact(record):
+    try:
+        for path in record.get("profile", {}).values():
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(record["path"]):
+            os.remove(record["path"])
+        folder = record.get("folder")
+        if folder and os.path.exists(folder):
+            shutil.rmtree(folder, ignore_errors=True)
+    except:
+        pass
+
+class ExpiryScheduler:
+    """Deletes artifacts close to their deadline from a min-heap of (exp, key).
+
+    The loop sleeps until the earliest deadline or until a new artifact is
+    scheduled. Files are removed off the event loop. A slow sweep of
+    STORE.expired() also claims records left by other or crashed workers of
+    this node; records of other nodes are left to them.
+
+    The quota covers all of BASE_DIR (every worker's ZIPs, page folders, caches,
+    manifests and profiles): it is rescanned every DISK_SCAN_INTERVAL seconds
+    and each worker evicts its own ZIPs while the total is over the quota.
+    """
+    def __init__(self, quota_bytes=DISK_QUOTA_BYTES, sweep_interval=EXPIRY_SWEEP_INTERVAL, scan_interval=DISK_SCAN_INTERVAL):
+        self.quota_bytes = quota_bytes
+        self.sweep_interval = sweep_interval
+        self.scan_interval = scan_interval
+        self.heap = []
+        self.sizes: Dict[str, int] = {}
+        self.disk_usage = 0
+        self.evicted = 0
+        self._wakeup = asyncio.Event()
+        self._next_sweep = 0.0
+        self._next_scan = 0.0
+
+    def schedule(self, key, exp, size=0):
+        heapq.heappush(self.heap, (exp, key))
+        self.forget(key)
+        self.sizes[key] = size
+        self.disk_usage += size
+        self._wakeup.set()
+
+    def forget(self, key):
+        self.sizes.pop(key, None)
+
+    async def run(self):
+        try:
+            await self.reclaim_orphans()
+        except Exception as e:
+            print(f"[ERROR] Orphan reclaim failed: {str(e)}")
+        while True:
+            try:
+                now = time.time()
+                if (self.heap and self.heap[0][0] <= now) or now >= self._next_sweep:
+                    await self.sweep()
+                await self.enforce_quota()
+            except Exception as e:
+                print(f"[ERROR] Artifact cleanup failed: {str(e)}")
+            deadline = min(self.heap[0][0] if self.heap else self._next_sweep, self._next_sweep, self._next_scan)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(deadline - time.time(), 0.05))
+            except asyncio.TimeoutError:
+                pass
+
+    async def sweep(self):
         now = time.time()
-        dead = []
-        for k, v in STORE.items():
-            if now > v["exp"]:
+        self._next_sweep = now + self.sweep_interval
+        while self.heap and self.heap[0][0] <= now:
+            _, key = heapq.heappop(self.heap)
+            self.forget(key)
+            if key.startswith("job:"):
+                JOBS.pop(key[4:], None)
+        for key, record in await STORE.expired():
+            self.forget(key)
+            if "path" in record:
+                await run_blocking(remove_artifact, record)
+        await JOB_STORE.expired()
+        await run_blocking(prune_manifests)
+
+    async def enforce_quota(self):
+        """Evicts this worker's artifacts closest to expiry until BASE_DIR fits DISK_QUOTA_MB"""
+        if time.time() >= self._next_scan:
+            self.disk_usage = await run_blocking(disk_usage, BASE_DIR)
+            self._next_scan = time.time() + self.scan_interval
+        if self.disk_usage <= self.quota_bytes:
+            return
+        for exp, key in sorted(self.heap):
+            if self.disk_usage <= self.quota_bytes:
+                break
+            if key not in self.sizes or key.startswith("job:"):
+                continue
+            size = self.sizes[key]
+            record = await STORE.delete(key)
+            self.forget(key)
+            if record and "path" in record:
+                await run_blocking(remove_artifact, record)
+                self.disk_usage -= size
+                self.evicted += 1
+                print(f"[INFO] Disk quota reached, evicted {key}")
+
+    async def reclaim_orphans(self):
+        """Removes page_* folders, ZIPs and profiles under BASE_DIR that no stored record points to"""
+        known = set()
+        for _, record in await STORE.records():
+            if "path" not in record:
+                continue
+            known.add(record["path"])
+            known.add(record.get("folder"))
+            known.update(record.get("profile", {}).values())
+        cutoff = time.time() - ORPHAN_GRACE
+
+        def reclaim():
+            removed = 0
+            for entry in os.scandir(BASE_DIR):
+                if entry.path in known:
+                    continue
+                if not (entry.name.startswith(("page_", "profile_")) or entry.name.endswith(".zip")):
+                    continue
                 try:
-                    if os.path.exists(v["path"]):
-                        os.remove(v["path"])
-                    folder = v.get("folder")
-                    if folder and os.path.exists(folder):
-                        shutil.rmtree(folder, ignore_errors=True)
-                except:
-                    pass
-                dead.append(k)
-        for k in dead:
-            STORE.pop(k, None)
+                    if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    continue
+            return removed
+
+        removed = await run_blocking(reclaim)
+        if removed:
+            print(f"[INFO] Reclaimed {removed} orphaned artifacts")
+
+EXPIRY = ExpiryScheduler()
+
+class JobManager:
+    """Runs /api/jobs captures on a bounded worker pool, new jobs are refused once the queue is full"""
+    def __init__(self, workers=JOB_WORKERS, queue_limit=JOB_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_limit)
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, url, base_url, crawl=None, profile=False, incremental=None):
+        """Queues a capture and returns its job record, or None when the queue is full"""
+        self.start()
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "url": url,
+            "base_url": base_url,
+            "crawl": crawl,
+            "profile": profile,
+            "incremental": incremental,
+            "status": "queued",
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "exp": None,
+            "downloader": None,
+            "progress": None,
+            "result": None
+        }
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            return None
+        JOBS[job_id] = job
+        await self._publish(job)
+        return job
+
+    async def _publish(self, job):
+        """Mirrors the job status into JOB_STORE so any worker can answer /api/jobs/{id}"""
+        try:
+            await JOB_STORE.put(job["id"], {"status": job_status(job)}, ttl=300 if job["exp"] else 3600)
+            if job["exp"]:
+                EXPIRY.schedule(f"job:{job['id']}", job["exp"])
+        except Exception as e:
+            print(f"[ERROR] Failed to publish job {job['id']}: {str(e)}")
+
+    def queued(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = JOBS.get(job_id)
+            if job is None:
+                continue
+            job["status"] = "running"
+            job["started"] = time.time()
+            job["downloader"] = UrlDownloader(cache=ASSET_CACHE)
+            await self._publish(job)
+            try:
+                status_code, content = await capture_website(
+                    job["url"], job_id, job["base_url"], job["downloader"], job["crawl"], job["profile"], job["incremental"]
+                )
+                job["status"] = "done" if status_code == 200 else "failed"
+                job["result"] = content
+            except Exception as e:
+                job["status"] = "failed"
+                job["result"] = {"success": False, "error": str(e)}
+            # Keep the counters only, the downloader holds every parsed page until it is dropped
+            job["progress"] = job["downloader"].progress()
+            job["downloader"] = None
+            job["finished"] = time.time()
+            job["exp"] = job["finished"] + 300
+            await self._publish(job)
+
+class CaptureProfiler:
+    """Runs cProfile and tracemalloc around one capture and writes the report next to its archive.
+
+    cProfile only sees the event loop thread, so work offloaded to BLOCKING_POOL
+    (zipping, file writes) shows up as time waiting on futures, and other requests
+    served meanwhile are included; callers hold PROFILE_LOCK so one runs at a time.
+    """
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.snapshot = None
+        self.peak_bytes = 0
+        self._own_tracing = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._own_tracing = True
+        tracemalloc.reset_peak()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.peak_bytes = tracemalloc.get_traced_memory()[1]
+        if self._own_tracing:
+            tracemalloc.stop()
+
+    def write(self, fid):
+        """Saves profile_<fid>.prof (pstats) and profile_<fid>.txt, returns their paths by format"""
+        paths = {
+            "prof": os.path.join(BASE_DIR, f"profile_{fid}.prof"),
+            "txt": os.path.join(BASE_DIR, f"profile_{fid}.txt")
+        }
+        self.profiler.dump_stats(paths["prof"])
+        report = io.StringIO()
+        report.write(f"Capture {fid}\nPeak traced memory: {self.peak_bytes / (1024 * 1024):.1f} MB\n\n")
+        report.write(f"Top {PROFILE_TOP} functions by cumulative time\n")
+        pstats.Stats(self.profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        report.write(f"Top {PROFILE_TOP} allocation sites\n")
+        snapshot = self.snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ])
+        for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+            report.write(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {stat.traceback}\n")
+        with open(paths["txt"], 'w') as f:
+            f.write(report.getvalue())
+        return paths
+
+def is_admin(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def profile_denied(request: Request, profile):
+    """Error response when a profiled capture is not allowed right now, else None"""
+    if not profile:
+        return None
+    if not is_admin(request):
+        return JSONResponse(
+            status_code=403,
+            content={
+                "success": False,
+                "error": "Profiling requires a valid X-Admin-Token header",
+                "Developer": "Haseeb Sahil",
+                "tg_channel": "@hsmodzofc2"
+            }
+        )
+    return None
+
+def job_status(job):
+    status = {
+        "success": job["status"] != "failed",
+        "job_id": job["id"],
+        "url": job["url"],
+        "status": job["status"],
+        "created": datetime.fromtimestamp(job["created"]).isoformat()
+    }
+    if job["downloader"] is not None:
+        status["progress"] = job["downloader"].progress()
+    elif job["progress"] is not None:
+        status["progress"] = job["progress"]
+    if job["started"]:
+        end = job["finished"] or time.time()
+        status["elapsed_seconds"] = round(end - job["started"], 2)
+    if job["result"] is not None:
+        result = dict(job["result"])
+        result.pop("success", None)
+        status.update(result)
+    return status
+
+JOB_MANAGER = JobManager()
+
+class CaptureCoalescer:
+    """Single-flight for /api/web in this worker process.
+
+    Requests with the same capture_key wait on the first one's capture_website
+    task and get its file_id. The task is shielded, so a leader that disconnects
+    does not cancel the capture for the others.
+    """
+    def __init__(self, ttl=RESULT_CACHE_SECONDS):
+        self.ttl = ttl
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.results: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @staticmethod
+    def capture_key(url, crawl, incremental=None):
+        return json.dumps([canonicalize_url(url), crawl or {}, incremental], sort_keys=True)
+
+    async def capture(self, url, base_url, crawl=None, incremental=None):
+        """Returns (status_code, response content) like capture_website"""
+        key = self.capture_key(url, crawl, incremental)
+        content = await self._cached(key)
+        if content is not None:
+            COALESCED.inc(source="cache")
+            return 200, self._shared(content, base_url)
+        task = self.in_flight.get(key)
+        if task is not None:
+            COALESCED.inc(source="in_flight")
+            status_code, content = await asyncio.shield(task)
+            return status_code, self._shared(content, base_url)
+        task = asyncio.create_task(capture_website(url, uuid.uuid4().hex, base_url, crawl=crawl, incremental=incremental))
+        self.in_flight[key] = task
+        task.add_done_callback(partial(self._finished, key))
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        self.in_flight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        status_code, content = task.result()
+        if status_code == 200 and self.ttl > 0:
+            self.results[key] = (time.time() + self.ttl, time.time(), content)
+            self.results.move_to_end(key)
+
+    async def _cached(self, key):
+        now = time.time()
+        while self.results and next(iter(self.results.values()))[0] <= now:
+            self.results.popitem(last=False)
+        cached = self.results.get(key)
+        if cached is None:
+            return None
+        _, created, content = cached
+        if await STORE.get(content["file_id"]) is None:
+            del self.results[key]
+            return None
+        return dict(content, expires_in_seconds=max(int(created + 300 - now), 0))
+
+    @staticmethod
+    def _shared(content, base_url):
+        content = dict(content, coalesced=True)
+        if content.get("success"):
+            content["download_url"] = f"{base_url}/download/{content['file_id']}"
+        return content
+
+COALESCER = CaptureCoalescer()
 
 def get_local_ip():
     try:
@@ -669,10 +3087,21 @@ def get_local_ip():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    cleaner_thread = threading.Thread(target=clean_expired_files, daemon=True)
-    cleaner_thread.start()
-    print(f"[INFO] File cleaner started")
+    cleaner_task = asyncio.create_task(EXPIRY.run())
+    lag_task = asyncio.create_task(LOOP_LAG.run())
+    print(f"[INFO] File cleaner started ({type(STORE).__name__})")
+    get_http_pool()
+    await run_blocking(ASSET_CACHE.load)
+    JOB_MANAGER.start()
+    print(f"[INFO] Connection pool ready (limit={POOL_LIMIT}, per_host={POOL_LIMIT_PER_HOST}, transport={HTTP_TRANSPORT}, http2={HTTP2_AVAILABLE}, accept_encoding={accept_encoding()})")
     yield
+    cleaner_task.cancel()
+    lag_task.cancel()
+    await JOB_MANAGER.stop()
+    await close_http_pool()
+    await STORE.close()
+    await JOB_STORE.close()
+    await run_blocking(ASSET_CACHE.save)
     print(f"[INFO] Shutting down API")
 
 # Create app with lifespan
@@ -693,16 +3122,86 @@ async def home(request: Request):
         return templates.TemplateResponse("index.html", {"request": request})
     raise HTTPException(status_code=404, detail="Template not found")
 
-@app.get("/api/web")
-async def download_website(request: Request, url: str = Query(..., description="Website URL to download")):
-    start_time = time.time()
-    
-    if not url.startswith(('http://', 'https://')):
-        url = f"https://{url}"
-    
-    fid = uuid.uuid4().hex
-    pagefolder = os.path.join(BASE_DIR, f"page_{fid}")
-    
+def get_http_pool():
+    """Shared connector, created by lifespan or lazily when the app runs without it (e.g. on Vercel)"""
+    global HTTP_POOL
+    if HTTP_POOL is None or HTTP_POOL.closed:
+        HTTP_POOL = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            limit_per_host=POOL_LIMIT_PER_HOST,
+            keepalive_timeout=POOL_KEEPALIVE,
+            ttl_dns_cache=300
+        )
+    return HTTP_POOL
+
+def get_httpx_client():
+    """Shared httpx client for HTTP_TRANSPORT=httpx, created lazily like the aiohttp pool.
+    httpx has no per-host connection cap, so POOL_LIMIT_PER_HOST does not apply here;
+    HOST_CONCURRENCY limits concurrent downloads per host for either transport"""
+    global HTTPX_CLIENT
+    if HTTPX_CLIENT is None or HTTPX_CLIENT.is_closed:
+        HTTPX_CLIENT = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=POOL_LIMIT,
+                max_keepalive_connections=POOL_LIMIT,
+                keepalive_expiry=POOL_KEEPALIVE
+            ),
+            timeout=httpx.Timeout(15, connect=20)
+        )
+    return HTTPX_CLIENT
+
+async def close_http_pool():
+    global HTTP_POOL, HTTPX_CLIENT
+    if HTTP_POOL is not None:
+        await HTTP_POOL.close()
+        HTTP_POOL = None
+    if HTTPX_CLIENT is not None:
+        await HTTPX_CLIENT.aclose()
+        HTTPX_CLIENT = None
+
+class HttpxResponse:
+    """The part of the aiohttp response API UrlDownloader uses, over a streamed httpx response"""
+    def __init__(self, response):
+        self._response = response
+        self.status = response.status_code
+        self.headers = response.headers
+        self.content = self
+
+    @property
+    def content_length(self):
+        value = self.headers.get('content-length', '')
+        return int(value) if value.isdigit() else None
+
+    def iter_chunked(self, size):
+        # Raw bytes: decoding is left to BodyDecoder, as with auto_decompress=False
+        return self._response.aiter_raw(size)
+
+class HttpxSession:
+    """aiohttp-style session over the shared httpx client; with h2 installed, requests to
+    an HTTP/2 origin are multiplexed over one connection instead of one per asset"""
+    def __init__(self, client):
+        self.client = client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    @asynccontextmanager
+    async def get(self, url, timeout=None, headers=None, allow_redirects=True):
+        request = self.client.build_request('GET', url, headers=headers, timeout=timeout or httpx.USE_CLIENT_DEFAULT)
+        try:
+            response = await self.client.send(request, stream=True, follow_redirects=allow_redirects)
+        except httpx.TimeoutException as e:
+            raise asyncio.TimeoutError() from e
+        try:
+            yield HttpxResponse(response)
+        finally:
+            await response.aclose()
+
+def public_base_url(request: Request):
     base_url = str(request.base_url).rstrip('/')
     if request.headers.get("x-forwarded-proto"):
         scheme = request.headers.get("x-forwarded-proto")
@@ -712,99 +3211,324 @@ async def download_website(request: Request, url: str = Query(..., description="
         host = request.headers.get("host")
         scheme = "https" if "443" in host or request.url.scheme == "https" else "http"
         base_url = f"{scheme}://{host}"
+    return base_url
+
+def new_client_session():
+    """Per-request view on the shared pool, closing it leaves the pooled connections alive"""
+    if HTTP_TRANSPORT == "httpx":
+        return HttpxSession(get_httpx_client())
+    timeout = aiohttp.ClientTimeout(total=120, connect=20, sock_read=15)
+    return aiohttp.ClientSession(
+        connector=get_http_pool(),
+        connector_owner=False,
+        timeout=timeout,
+        auto_decompress=False
+    )
+
+def record_capture(downloader, result):
+    """Adds a finished capture's totals to the metrics"""
+    CAPTURES.inc(result=result)
+    CACHE_HITS.inc(downloader.cache_hits)
+    FAILED_URLS.inc(len(downloader.failed_urls))
+    SKIPPED_FILES.inc(downloader.budget.skipped)
+
+async def stream_website(url, fid, crawl=None):
+    """Sends the capture of url as a ZIP built while it downloads; no ZIP file or STORE record is kept.
+
+    The response starts once the first member is queued, a capture that fails before that gets a 400
+    JSON error. Members are written in the order downloads finish, the rewritten pages last; bodies over
+    SPOOL_MAX_BYTES wait in temporary files under BASE_DIR. A client disconnect cancels the capture."""
+    budget = CaptureBudget()
+    archive = ZipStreamWriter(budget.max_bytes)
+    downloader = UrlDownloader(archive=archive, cache=ASSET_CACHE, budget=budget)
+    CAPTURES_IN_FLIGHT.inc()
+
+    async def capture():
+        try:
+            async with new_client_session() as session:
+                return await downloader.crawl(url, '', session, **(crawl or {}))
+        finally:
+            archive.close()
+
+    task = asyncio.create_task(capture())
+    started = asyncio.create_task(archive.started.wait())
+    await asyncio.wait({task, started}, return_when=asyncio.FIRST_COMPLETED)
+    if task.done():
+        success, error, _ = task.result()
+        if not success:
+            started.cancel()
+            CAPTURES_IN_FLIGHT.dec()
+            record_capture(downloader, "failed")
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "success": False,
+                    "error": error,
+                    "Developer": "Haseeb Sahil",
+                    "tg_channel": "@hsmodzofc2"
+                }
+            )
+
+    async def body():
+        try:
+            async for chunk in archive.stream():
+                BYTES_OUT.inc(len(chunk))
+                yield chunk
+        finally:
+            if not task.done():
+                task.cancel()
+            CAPTURES_IN_FLIGHT.dec()
+            STAGE_SECONDS.observe(archive.zip_seconds, stage='zip')
+            record_capture(downloader, "streamed")
+            domain = urlparse(url).netloc.replace('www.', '')
+            ratio = archive.total_size / archive.zip_bytes if archive.zip_bytes else 0
+            print(f"[INFO] Streamed archive for {domain} - Files: {archive.file_count} - Size: {archive.total_size/(1024*1024):.2f}MB - Ratio: {ratio:.2f} - Zip time: {archive.zip_seconds:.2f}s")
+
+    return StreamingResponse(
+        body(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=website_source_{fid}.zip"}
+    )
+
+async def capture_website(url, fid, base_url, downloader=None, crawl=None, profile=False, incremental=None):
+    """Captures url into BASE_DIR, registers the ZIP in STORE and returns (status_code, response content).
+    incremental is None, "full" (revalidate against the page's manifest) or "delta" (also drop unchanged assets)"""
+    if profile is True:
+        async with PROFILE_LOCK:
+            return await capture_website(url, fid, base_url, downloader, crawl, CaptureProfiler(), incremental)
+    start_time = time.time()
+    pagefolder = os.path.join(BASE_DIR, f"page_{fid}")
+    if downloader is None:
+        downloader = UrlDownloader(cache=ASSET_CACHE)
+    CAPTURES_IN_FLIGHT.inc()
     
     try:
-        connector = aiohttp.TCPConnector(limit=150, limit_per_host=50, ttl_dns_cache=300)
-        timeout = aiohttp.ClientTimeout(total=120, connect=20, sock_read=15)
-        
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=False) as session:
-            downloader = UrlDownloader()
-            success, error, file_paths = await downloader.savePage(url, pagefolder, session)
+        if incremental:
+            downloader.manifest = await run_blocking(SiteManifest.load, canonicalize_url(url))
+        async with new_client_session() as session:
+            if profile:
+                profile.start()
+            try:
+                success, error, file_paths = await downloader.crawl(url, pagefolder, session, **(crawl or {}))
+            finally:
+                if profile:
+                    profile.stop()
             
             if not success:
-                if file_paths:
-                    for fp in file_paths:
-                        try:
-                            os.remove(fp)
-                        except:
-                            pass
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": error,
-                        "Developer": "Haseeb Sahil",
-                        "tg_channel": "@hsmodzofc2"
-                    }
-                )
+                await run_blocking(discard_files, file_paths, pagefolder)
+                record_capture(downloader, "failed")
+                return 400, {
+                    "success": False,
+                    "error": error,
+                    "Developer": "Haseeb Sahil",
+                    "tg_channel": "@hsmodzofc2"
+                }
             
-            zip_file_path = create_zip(pagefolder)
+            manifest = downloader.manifest
+            if manifest is not None:
+                delta = manifest.diff(downloader.snapshot)
+                if incremental == "delta":
+                    await run_blocking(prune_unchanged, pagefolder, downloader.snapshot, delta, manifest.captured)
+                snapshot_summary = {
+                    "base_captured_at": datetime.fromtimestamp(manifest.captured).isoformat() if manifest.captured else None,
+                    "delta": incremental == "delta",
+                    "revalidated": downloader.revalidated,
+                    **{state: len(urls) for state, urls in delta.items()}
+                }
             
-            for fp in file_paths:
-                try:
-                    os.remove(fp)
-                except:
-                    pass
-            try:
-                shutil.rmtree(pagefolder, ignore_errors=True)
-            except:
-                pass
+            zip_stats = {}
+            with downloader.stage('zip'):
+                pages = frozenset(page.path for page in downloader.pages.values())
+                zip_file_path = await run_archive(create_zip, pagefolder, zip_stats, downloader.budget.max_bytes, pages)
+            if zip_file_path and manifest is not None:
+                manifest.update(downloader.snapshot)
+                await run_blocking(manifest.save, downloader.cache, pagefolder)
+            with downloader.stage('cleanup'):
+                await run_blocking(discard_files, file_paths, pagefolder)
             
             if not zip_file_path:
-                return JSONResponse(
-                    status_code=500,
-                    content={
-                        "success": False,
-                        "error": "Failed to create zip archive",
-                        "Developer": "Haseeb Sahil",
-                        "tg_channel": "@hsmodzofc2"
-                    }
-                )
+                record_capture(downloader, "failed")
+                return 500, {
+                    "success": False,
+                    "error": "Failed to create zip archive",
+                    "Developer": "Haseeb Sahil",
+                    "tg_channel": "@hsmodzofc2"
+                }
             
-            expiry = time.time() + 300
-            STORE[fid] = {
+            artifact = {
                 "path": zip_file_path,
-                "exp": expiry,
-                "folder": pagefolder
+                "folder": pagefolder,
+                "node": NODE_ID
             }
+            if profile:
+                artifact["profile"] = await run_blocking(profile.write, fid)
+            await STORE.put(fid, artifact, ttl=300)
+            zip_size = await run_blocking(os.path.getsize, zip_file_path)
+            EXPIRY.schedule(fid, time.time() + 300, zip_size)
             
-            zip_size = os.path.getsize(zip_file_path)
             domain = urlparse(url).netloc.replace('www.', '')
             time_taken = time.time() - start_time
             
             download_url = f"{base_url}/download/{fid}"
             
             print(f"[INFO] Successfully created archive for {domain} - Size: {zip_size/(1024*1024):.2f}MB - Time: {time_taken:.2f}s")
+            record_capture(downloader, "success")
             
-            return JSONResponse(content={
+            return 200, {
                 "success": True,
                 "file_id": fid,
                 "download_url": download_url,
                 "domain": domain,
                 "file_size_mb": round(zip_size / (1024 * 1024), 2),
                 "file_count": len(file_paths),
+                "pages": len(downloader.pages),
+                "cache_hits": downloader.cache_hits,
+                "bytes_on_wire": downloader.wire_bytes,
+                "duplicates_saved": downloader.duplicates_saved,
+                "skipped_files": downloader.budget.skipped,
+                "compression_ratio": round(zip_stats["raw_bytes"] / zip_stats["zip_bytes"], 2),
+                "zip_time_seconds": round(zip_stats["seconds"], 3),
                 "time_taken_seconds": round(time_taken, 2),
+                "timings": {stage: round(seconds, 3) for stage, seconds in downloader.timings.items()},
+                **({"profile_url": f"{download_url}/profile"} if profile else {}),
+                **({"incremental": snapshot_summary} if manifest is not None else {}),
                 "expires_in_seconds": 300,
                 "Developer": "Haseeb Sahil",
                 "tg_channel": "@hsmodzofc2"
-            })
+            }
             
     except Exception as e:
         print(f"[ERROR] Failed to process {url}: {str(e)}")
-        try:
-            if os.path.exists(pagefolder):
-                shutil.rmtree(pagefolder, ignore_errors=True)
-        except:
-            pass
+        await run_blocking(discard_files, [], pagefolder)
+        record_capture(downloader, "failed")
+        return 500, {
+            "success": False,
+            "error": str(e),
+            "Developer": "Haseeb Sahil",
+            "tg_channel": "@hsmodzofc2"
+        }
+    finally:
+        CAPTURES_IN_FLIGHT.dec()
+
+def crawl_options(depth, max_pages, scope):
+    """Crawl keyword arguments for UrlDownloader.crawl, None for a single-page capture"""
+    if max_pages is None:
+        max_pages = CRAWL_MAX_PAGES if depth else 1
+    if depth == 0 or max_pages == 1:
+        return None
+    return {"depth": depth, "max_pages": max_pages, "scope": scope}
+
+def incremental_mode(incremental, delta):
+    """capture_website incremental argument for the incremental/delta query flags"""
+    if delta:
+        return "delta"
+    return "full" if incremental else None
+
+@app.get("/api/web")
+async def download_website(
+    request: Request,
+    url: str = Query(..., description="Website URL to download"),
+    stream: bool = Query(False, description="Stream the ZIP as it is built instead of returning a download link"),
+    depth: int = Query(0, ge=0, le=CRAWL_MAX_DEPTH, description="Follow links this many levels deep"),
+    max_pages: Optional[int] = Query(None, ge=1, le=CRAWL_MAX_PAGES, description="Stop crawling after this many pages, CRAWL_MAX_PAGES by default"),
+    scope: str = Query("origin", pattern="^(origin|prefix)$", description="Follow same-origin links, or only those under the start URL's path"),
+    profile: bool = Query(False, description="Admin only: save a cProfile and tracemalloc report with the archive"),
+    incremental: bool = Query(False, description="Revalidate assets against the last incremental capture of this page"),
+    delta: bool = Query(False, description="Incremental capture that leaves out assets unchanged since the last one")
+):
+    if not url.startswith(('http://', 'https://')):
+        url = f"https://{url}"
+    
+    denied = profile_denied(request, profile)
+    if denied is not None:
+        return denied
+    if stream and (incremental or delta):
+        return JSONResponse(
+            status_code=400,
+            content={
+                "success": False,
+                "error": "Incremental captures are not available for streamed captures",
+                "Developer": "Haseeb Sahil",
+                "tg_channel": "@hsmodzofc2"
+            }
+        )
+    if profile and (stream or PROFILE_LOCK.locked()):
+        return JSONResponse(
+            status_code=400 if stream else 409,
+            content={
+                "success": False,
+                "error": "Profiling is not available for streamed captures" if stream else "A profiled capture is already running",
+                "Developer": "Haseeb Sahil",
+                "tg_channel": "@hsmodzofc2"
+            }
+        )
+    
+    fid = uuid.uuid4().hex
+    crawl = crawl_options(depth, max_pages, scope)
+    if stream:
+        return await stream_website(url, fid, crawl)
+    
+    mode = incremental_mode(incremental, delta)
+    if profile:
+        status_code, content = await capture_website(url, fid, public_base_url(request), crawl=crawl, profile=profile, incremental=mode)
+    else:
+        status_code, content = await COALESCER.capture(url, public_base_url(request), crawl, mode)
+    return JSONResponse(status_code=status_code, content=content)
+
+@app.post("/api/jobs")
+async def create_job(
+    request: Request,
+    url: str = Query(..., description="Website URL to capture in the background"),
+    depth: int = Query(0, ge=0, le=CRAWL_MAX_DEPTH, description="Follow links this many levels deep"),
+    max_pages: Optional[int] = Query(None, ge=1, le=CRAWL_MAX_PAGES, description="Stop crawling after this many pages, CRAWL_MAX_PAGES by default"),
+    scope: str = Query("origin", pattern="^(origin|prefix)$", description="Follow same-origin links, or only those under the start URL's path"),
+    profile: bool = Query(False, description="Admin only: save a cProfile and tracemalloc report with the archive"),
+    incremental: bool = Query(False, description="Revalidate assets against the last incremental capture of this page"),
+    delta: bool = Query(False, description="Incremental capture that leaves out assets unchanged since the last one")
+):
+    if not url.startswith(('http://', 'https://')):
+        url = f"https://{url}"
+    
+    denied = profile_denied(request, profile)
+    if denied is not None:
+        return denied
+    job = await JOB_MANAGER.submit(
+        url, public_base_url(request), crawl_options(depth, max_pages, scope), profile, incremental_mode(incremental, delta)
+    )
+    if job is None:
         return JSONResponse(
-            status_code=500,
+            status_code=429,
+            headers={"Retry-After": "10"},
             content={
                 "success": False,
-                "error": str(e),
+                "error": "Too many queued captures, try again shortly",
                 "Developer": "Haseeb Sahil",
                 "tg_channel": "@hsmodzofc2"
             }
         )
+    
+    return JSONResponse(
+        status_code=202,
+        content={
+            "success": True,
+            "job_id": job["id"],
+            "status": job["status"],
+            "status_url": f"{public_base_url(request)}/api/jobs/{job['id']}",
+            "queue_position": JOB_MANAGER.queued(),
+            "Developer": "Haseeb Sahil",
+            "tg_channel": "@hsmodzofc2"
+        }
+    )
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = JOBS.get(job_id)
+    if job is not None:
+        return JSONResponse(content=job_status(job))
+    record = await JOB_STORE.get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return JSONResponse(content=record["status"])
 
 @app.get("/api/recover")
 async def recover_source(url: str = Query(..., description="InfinityFree URL to recover source from")):
@@ -868,31 +3592,63 @@ async def debug_url(url: str = Query(..., description="URL to debug")):
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+@app.get("/api/stats")
+async def stats():
+    """Live download scheduler counters across in-flight captures"""
+    schedulers = [scheduler.stats() for scheduler in list(ACTIVE_SCHEDULERS)]
+    return JSONResponse({
+        "active_captures": sum(1 for st in schedulers if st["queued"] or st["in_flight"]),
+        "queue_depth": sum(st["queued"] for st in schedulers),
+        "in_flight": sum(st["in_flight"] for st in schedulers),
+        "stored_files": await STORE.count(),
+        "queued_jobs": JOB_MANAGER.queued(),
+        "loop_lag": LOOP_LAG.stats()
+    })
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/download/{file_id}")
 async def download_file(file_id: str):
-    if file_id not in STORE:
+    data = await STORE.get(file_id)
+    if data is None or "path" not in data:
         raise HTTPException(status_code=404, detail="File not found or expired")
     
-    data = STORE[file_id]
-    
-    if time.time() > data["exp"]:
-        try:
-            os.remove(data["path"])
-        except:
-            pass
-        STORE.pop(file_id, None)
-        raise HTTPException(status_code=404, detail="File expired")
-    
+    if data.get("node", NODE_ID) != NODE_ID:
+        raise HTTPException(status_code=404, detail="File is stored on another node")
     if not os.path.exists(data["path"]):
-        STORE.pop(file_id, None)
+        await STORE.delete(file_id)
+        EXPIRY.forget(file_id)
         raise HTTPException(status_code=404, detail="File not found")
     
+    BYTES_OUT.inc(await run_blocking(os.path.getsize, data["path"]))
     return FileResponse(
         data["path"],
         media_type="application/zip",
         filename=f"website_source_{file_id}.zip"
     )
 
+@app.get("/download/{file_id}/profile")
+async def download_profile(
+    request: Request,
+    file_id: str,
+    format: str = Query("txt", pattern="^(txt|prof)$", description="txt report or pstats .prof dump")
+):
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Profiles require a valid X-Admin-Token header")
+    data = await STORE.get(file_id)
+    path = (data or {}).get("profile", {}).get(format)
+    if not path or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found or expired")
+    
+    return FileResponse(
+        path,
+        media_type="text/plain" if format == "txt" else "application/octet-stream",
+        filename=f"profile_{file_id}.{format}"
+    )
+
 if __name__ == "__main__":
     local_ip = get_local_ip()
     
@@ -908,8 +3664,12 @@ if __name__ == "__main__":
     print(f"  Available Endpoints:")
     print(f"  - GET  /                    - Home page")
     print(f"  - GET  /api/web?url=URL     - Download full website as ZIP")
+    print(f"  - GET  /api/web?url=URL&stream=1 - Stream website ZIP directly")
+    print(f"  - POST /api/jobs?url=URL    - Queue a background capture")
+    print(f"  - GET  /api/jobs/{{job_id}}    - Background capture status")
     print(f"  - GET  /api/recover?url=URL - Recover InfinityFree source")
     print(f"  - GET  /api/debug?url=URL   - Debug URL")
+    print(f"  - GET  /api/stats           - Live capture counters")
     print(f"  - GET  /download/{file_id}   - Download ZIP file")
     print(f"{'='*60}")
     print(f"  Dev: Haseeb Sahil")
@@ -0,0 +1,187 @@
+"""Capture throughput and latency against a local fixture site, reported as JSON.
+
+Usage: python benchmarks/capture_bench.py [--stages savepage,zip,app] [--requests 20]
+       [--concurrency 4] [--assets 50] [--asset-kb 8] [--slow 0] [--redirects 0]
+       [--html-kb 0] [--css-depth 0] [--output result.json]
+
+Stages:
+  savepage  UrlDownloader.savePage into a temporary folder, asset cache off
+  zip       create_zip over one captured folder
+  app       GET /api/web on the FastAPI app in-process, lifespan included; each
+            request has its own URL so none of them are coalesced
+
+Each stage reports latency percentiles in seconds, pages/s and bytes/s;
+peak RSS and event-loop lag cover the whole run.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import itertools
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import httpx  # noqa: E402
+import index  # noqa: E402
+from fixture_site import FixtureSite  # noqa: E402
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return round(ordered[min(rank, len(ordered) - 1)], 4)
+
+
+def summarize(latencies, errors, wall, total_bytes):
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": round(sum(latencies) / len(latencies), 4) if latencies else None,
+        "wall_seconds": round(wall, 3),
+        "pages_per_s": round(len(latencies) / wall, 2) if wall else None,
+        "bytes_per_s": round(total_bytes / wall) if wall else None
+    }
+
+
+async def run_load(job, requests, concurrency):
+    """Runs job() requests times, concurrency at a time; job returns bytes handled or raises"""
+    latencies, errors, total_bytes = [], 0, 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors, total_bytes
+        async with slots:
+            started = time.perf_counter()
+            try:
+                total_bytes += await job()
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return summarize(latencies, errors, time.perf_counter() - started, total_bytes)
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(folder) for f in files)
+
+
+async def bench_savepage(site, args, workdir):
+    async def job():
+        folder = tempfile.mkdtemp(dir=workdir)
+        try:
+            async with index.new_client_session() as session:
+                success, error, _ = await index.UrlDownloader().savePage(site.url, folder, session)
+            if not success:
+                raise RuntimeError(error)
+            return folder_size(folder)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return await run_load(job, args.requests, args.concurrency)
+
+
+async def bench_zip(site, args, workdir):
+    folder = os.path.join(workdir, 'zip_source')
+    async with index.new_client_session() as session:
+        success, error, _ = await index.UrlDownloader().savePage(site.url, folder, session)
+    if not success:
+        return {"error": error}
+    size = folder_size(folder)
+
+    async def job():
+        zip_path = await index.run_archive(index.create_zip, folder)
+        if not zip_path:
+            raise RuntimeError("create_zip failed")
+        os.unlink(zip_path)
+        return size
+
+    return await run_load(job, args.requests, args.concurrency)
+
+
+async def bench_app(site, args, workdir):
+    # A distinct query string per request keeps /api/web from coalescing them into one capture
+    serial = itertools.count()
+    async with index.lifespan(index.app):
+        transport = httpx.ASGITransport(app=index.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=300) as client:
+            async def job():
+                response = await client.get('/api/web', params={"url": f"{site.url}?bench={next(serial)}"})
+                if response.status_code != 200:
+                    raise RuntimeError(response.text)
+                body = response.json()
+                record = await index.STORE.get(body["file_id"])
+                if record is not None:
+                    index.remove_artifact(record)
+                    await index.STORE.delete(body["file_id"])
+                return int(body["file_size_mb"] * 1024 * 1024)
+
+            return await run_load(job, args.requests, args.concurrency)
+
+
+STAGES = {"savepage": bench_savepage, "zip": bench_zip, "app": bench_app}
+
+
+async def main(args):
+    site = await FixtureSite(
+        assets=args.assets, asset_kb=args.asset_kb, slow=args.slow, slow_delay=args.slow_delay,
+        redirects=args.redirects, html_kb=args.html_kb, css_depth=args.css_depth
+    ).start()
+    monitor = index.LoopLagMonitor(interval=0.05)
+    lag_task = asyncio.create_task(monitor.run())
+    workdir = tempfile.mkdtemp(prefix='capture_bench_')
+    result = {
+        "shape": {
+            "assets": args.assets, "asset_kb": args.asset_kb, "slow": args.slow,
+            "slow_delay": args.slow_delay, "redirects": args.redirects,
+            "html_kb": args.html_kb, "css_depth": args.css_depth
+        },
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "stages": {}
+    }
+    try:
+        index.get_http_pool()
+        for stage in args.stages.split(','):
+            result["stages"][stage] = await STAGES[stage](site, args, workdir)
+    finally:
+        lag_task.cancel()
+        await index.close_http_pool()
+        await site.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    result["fixture_requests"] = site.requests
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    result["loop_lag"] = monitor.stats()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stages', default='savepage,zip,app')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--assets', type=int, default=50)
+    parser.add_argument('--asset-kb', type=int, default=8)
+    parser.add_argument('--slow', type=int, default=0)
+    parser.add_argument('--slow-delay', type=float, default=0.2)
+    parser.add_argument('--redirects', type=int, default=0)
+    parser.add_argument('--html-kb', type=int, default=0)
+    parser.add_argument('--css-depth', type=int, default=0)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+    report = json.dumps(asyncio.run(main(args)), indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
@@ -0,0 +1,73 @@
+"""Per-URL cost of asset classification on pages with thousands of assets.
+
+Usage: python benchmarks/classify_bench.py [asset_count] [rounds]
+
+Compares the first call for each URL (parse and build the record) with
+repeat calls (cache hits) and with path allocation on top of it.
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from index import ResourceClassifier, UrlDownloader  # noqa: E402
+
+
+def make_urls(count, seed=7):
+    rng = random.Random(seed)
+    kinds = ['css', 'js', 'png', 'jpg', 'webp', 'svg', 'woff2', 'json', '']
+    urls = []
+    for i in range(count):
+        ext = rng.choice(kinds)
+        depth = '/'.join(f"dir{rng.randint(0, 20)}" for _ in range(rng.randint(0, 4)))
+        name = f"asset_{i}.{ext}" if ext else f"asset_{i}"
+        query = f"?v={rng.randint(0, 999)}" if rng.random() < 0.3 else ''
+        urls.append(f"https://cdn{rng.randint(0, 3)}.example.com/{depth}/{name}{query}")
+    return urls
+
+
+def timed(fn, urls, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn(urls)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(urls) * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    urls = make_urls(count)
+    extensions = UrlDownloader().extensions
+
+    def cold(batch):
+        classifier = ResourceClassifier(extensions)
+        for url in batch:
+            classifier.classify(url)
+
+    warm_classifier = ResourceClassifier(extensions)
+    for url in urls:
+        warm_classifier.classify(url)
+
+    def warm(batch):
+        for url in batch:
+            warm_classifier.classify(url)
+
+    def allocate(batch):
+        downloader = UrlDownloader()
+        for url in batch:
+            downloader._get_resource_path(url, '')
+            downloader._get_local_path(url, '')
+
+    print(f"{count} URLs, best of {rounds} rounds, microseconds per URL")
+    print(f"  classify (first call):  {timed(cold, urls, rounds):8.2f}")
+    print(f"  classify (cached):      {timed(warm, urls, rounds):8.2f}")
+    print(f"  resource + local path:  {timed(allocate, urls, rounds):8.2f}")
+
+
+if __name__ == '__main__':
+    main()
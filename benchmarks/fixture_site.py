@@ -0,0 +1,123 @@
+"""Synthetic website served by aiohttp on localhost, for benchmarks that must not touch the network.
+
+The page at / references `assets` files of about `asset_kb` each (a mix of
+images, scripts, stylesheets and fonts). `slow` of them are served from a
+second host name (localhost instead of 127.0.0.1) after `slow_delay` seconds,
+`redirects` of them go through a redirect chain of `redirect_hops` hops,
+`css_depth` chains that many stylesheets with @import, and `html_kb` pads
+the page itself to that size.
+"""
+import asyncio
+import random
+
+from aiohttp import web
+
+ASSET_KINDS = (
+    ('png', 'image/png'),
+    ('jpg', 'image/jpeg'),
+    ('js', 'application/javascript'),
+    ('css', 'text/css'),
+    ('woff2', 'font/woff2'),
+)
+
+
+class FixtureSite:
+    def __init__(self, assets=50, asset_kb=8, slow=0, slow_delay=0.2, redirects=0, redirect_hops=3,
+                 html_kb=0, css_depth=0, port=0, seed=1):
+        self.assets = assets
+        self.asset_kb = asset_kb
+        self.slow = min(slow, assets)
+        self.slow_delay = slow_delay
+        self.redirects = min(redirects, assets)
+        self.redirect_hops = redirect_hops
+        self.html_kb = html_kb
+        self.css_depth = css_depth
+        self.port = port
+        self.runner = None
+        self.requests = 0
+        self.bytes_sent = 0
+        rng = random.Random(seed)
+        self._blob = bytes(rng.getrandbits(8) for _ in range(asset_kb * 1024))
+        self._text = ('/* fixture */ .c{color:#123456}\n' * (asset_kb * 1024 // 32 + 1))[:asset_kb * 1024]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/', self.index)
+        app.router.add_get('/a/{name}', self.asset)
+        app.router.add_get('/slow/{name}', self.slow_asset)
+        app.router.add_get('/r/{hops}/{name}', self.redirect)
+        app.router.add_get('/import/{level}.css', self.import_css)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def _asset_href(self, i):
+        ext = ASSET_KINDS[i % len(ASSET_KINDS)][0]
+        name = f"{i}.{ext}"
+        if i < self.slow:
+            return f"http://localhost:{self.port}/slow/{name}"
+        if i < self.slow + self.redirects:
+            return f"/r/{self.redirect_hops}/{name}"
+        return f"/a/{name}"
+
+    def _tag(self, href):
+        if href.endswith('.css'):
+            return f'<link rel="stylesheet" href="{href}">'
+        if href.endswith('.js'):
+            return f'<script src="{href}"></script>'
+        if href.endswith('.woff2'):
+            return f'<link rel="preload" href="{href}">'
+        return f'<img src="{href}">'
+
+    def _respond(self, body, content_type):
+        self.requests += 1
+        self.bytes_sent += len(body)
+        return web.Response(body=body, content_type=content_type)
+
+    async def index(self, request):
+        tags = [self._tag(self._asset_href(i)) for i in range(self.assets)]
+        if self.css_depth:
+            tags.append('<link rel="stylesheet" href="/import/0.css">')
+        page = '<!DOCTYPE html><html><head><title>fixture</title></head><body>\n' + '\n'.join(tags)
+        padding = self.html_kb * 1024 - len(page)
+        if padding > 0:
+            page += '\n<p>' + 'lorem ipsum dolor sit amet ' * (padding // 27 + 1) + '</p>'
+        return self._respond((page + '\n</body></html>').encode(), 'text/html')
+
+    async def asset(self, request):
+        name = request.match_info['name']
+        ext = name.rsplit('.', 1)[-1]
+        content_type = dict(ASSET_KINDS).get(ext, 'application/octet-stream')
+        if ext in ('css', 'js'):
+            return self._respond(self._text.encode(), content_type)
+        return self._respond(self._blob, content_type)
+
+    async def slow_asset(self, request):
+        await asyncio.sleep(self.slow_delay)
+        return await self.asset(request)
+
+    async def redirect(self, request):
+        hops = int(request.match_info['hops'])
+        name = request.match_info['name']
+        self.requests += 1
+        location = f"/r/{hops - 1}/{name}" if hops > 1 else f"/a/{name}"
+        raise web.HTTPFound(location)
+
+    async def import_css(self, request):
+        level = int(request.match_info['level'])
+        css = f".l{level}{{background:url(/a/{level}.png)}}\n"
+        if level + 1 < self.css_depth:
+            css = f'@import "/import/{level + 1}.css";\n' + css
+        return self._respond(css.encode(), 'text/css')
@@ -0,0 +1,132 @@
+"""In-process stand-in for a Redis server, for tests that must not need a real one.
+
+Speaks RESP2 over TCP on localhost and implements only the commands
+RedisArtifactStore sends: AUTH, SELECT, SET (with PX), GET, DEL, ZADD, ZREM,
+ZRANGEBYSCORE, ZREMRANGEBYSCORE and ZCOUNT. Each command runs to completion
+before the next one is read, like on a real server, so ZREM is atomic across
+clients.
+
+Failures can be injected per command name: `stall` sends half of the reply
+and waits that many seconds before the rest, `hangup` runs the command once
+and then closes the connection without replying.
+"""
+import asyncio
+import time
+
+
+def _score(value, inf):
+    if value in ('-inf', '+inf', 'inf'):
+        return -inf if value == '-inf' else inf
+    return float(value)
+
+
+class RedisStandin:
+    def __init__(self, port=0):
+        self.port = port
+        self.server = None
+        self.strings = {}
+        self.zsets = {}
+        self.commands = []
+        self.stall = {}
+        self.hangup = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, '127.0.0.1', self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:-2])):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2].decode())
+                name = args[0].upper()
+                reply = self._run(args)
+                if name in self.hangup:
+                    self.hangup.discard(name)
+                    break
+                if name in self.stall:
+                    writer.write(reply[:len(reply) // 2])
+                    await writer.drain()
+                    await asyncio.sleep(self.stall[name])
+                    reply = reply[len(reply) // 2:]
+                writer.write(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _get(self, key):
+        value = self.strings.get(key)
+        if value is None:
+            return None
+        data, deadline = value
+        if deadline is not None and time.time() >= deadline:
+            del self.strings[key]
+            return None
+        return data
+
+    def _range(self, key, low, high):
+        inf = float('inf')
+        low, high = _score(low, inf), _score(high, inf)
+        members = sorted(self.zsets.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+        return [member for member, score in members if low <= score <= high]
+
+    def _run(self, args):
+        name = args[0].upper()
+        self.commands.append(name)
+        if name in ('AUTH', 'SELECT'):
+            return b'+OK\r\n'
+        if name == 'SET':
+            deadline = None
+            options = [arg.upper() for arg in args[3:]]
+            if 'PX' in options:
+                deadline = time.time() + int(args[3 + options.index('PX') + 1]) / 1000
+            self.strings[args[1]] = (args[2], deadline)
+            return b'+OK\r\n'
+        if name == 'GET':
+            return _bulk(self._get(args[1]))
+        if name == 'DEL':
+            removed = sum(1 for key in args[1:] if self._get(key) is not None and self.strings.pop(key))
+            return b':%d\r\n' % removed
+        if name == 'ZADD':
+            zset = self.zsets.setdefault(args[1], {})
+            added = 0
+            for score, member in zip(args[2::2], args[3::2]):
+                added += member not in zset
+                zset[member] = float(score)
+            return b':%d\r\n' % added
+        if name == 'ZREM':
+            zset = self.zsets.get(args[1], {})
+            return b':%d\r\n' % sum(1 for member in args[2:] if zset.pop(member, None) is not None)
+        if name == 'ZRANGEBYSCORE':
+            members = self._range(args[1], args[2], args[3])
+            return b'*%d\r\n' % len(members) + b''.join(_bulk(member) for member in members)
+        if name == 'ZREMRANGEBYSCORE':
+            zset = self.zsets.get(args[1], {})
+            members = self._range(args[1], args[2], args[3])
+            for member in members:
+                del zset[member]
+            return b':%d\r\n' % len(members)
+        if name == 'ZCOUNT':
+            return b':%d\r\n' % len(self._range(args[1], args[2], args[3]))
+        return b"-ERR unknown command '%s'\r\n" % args[0].encode()
+
+
+def _bulk(value):
+    if value is None:
+        return b'$-1\r\n'
+    data = value.encode()
+    return b'$%d\r\n%s\r\n' % (len(data), data)
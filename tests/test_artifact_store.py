@@ -0,0 +1,189 @@
+"""ArtifactStore contract: put/get, hidden expired records, and claim-once expiry.
+
+Every backend runs the same checks; Redis runs against the in-process
+RedisStandin, so no server is needed.
+"""
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import index  # noqa: E402
+from redis_standin import RedisStandin  # noqa: E402
+
+BACKENDS = ('memory', 'sqlite', 'redis')
+
+
+def run_with_stores(kind, tmp_path, check, workers=1):
+    """Runs check(*stores) with `workers` stores sharing one backend"""
+    async def main():
+        standin = None
+        if kind == 'memory':
+            stores = [index.MemoryArtifactStore()] * workers
+        elif kind == 'sqlite':
+            stores = [index.SQLiteArtifactStore(str(tmp_path / 'artifacts.db')) for _ in range(workers)]
+        else:
+            standin = RedisStandin()
+            url = await standin.start()
+            stores = [index.RedisArtifactStore(url, prefix='test') for _ in range(workers)]
+        try:
+            await check(*stores)
+        finally:
+            for store in stores:
+                await store.close()
+            if standin is not None:
+                await standin.stop()
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_put_get_delete(kind, tmp_path):
+    async def check(store):
+        assert await store.get('missing') is None
+        await store.put('a', {"path": "/tmp/a.zip", "size": 3}, ttl=60)
+        record = await store.get('a')
+        assert record["path"] == "/tmp/a.zip" and record["size"] == 3
+        assert record["exp"] > index.time.time()
+        assert [key for key, _ in await store.records()] == ['a']
+        assert await store.count() == 1
+        assert (await store.delete('a'))["path"] == "/tmp/a.zip"
+        assert await store.get('a') is None
+        assert await store.count() == 0
+    run_with_stores(kind, tmp_path, check)
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_expired_records_are_hidden_and_claimed(kind, tmp_path):
+    async def check(store):
+        await store.put('old', {"path": "/tmp/old.zip"}, ttl=-1)
+        await store.put('new', {"path": "/tmp/new.zip"}, ttl=60)
+        assert await store.get('old') is None
+        assert [key for key, _ in await store.records()] == ['new']
+        assert await store.count() == 1
+        claimed = await store.expired()
+        assert [(key, record["path"]) for key, record in claimed] == [('old', "/tmp/old.zip")]
+        assert await store.expired() == []
+        assert (await store.get('new'))["path"] == "/tmp/new.zip"
+    run_with_stores(kind, tmp_path, check)
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_each_expired_record_is_claimed_once(kind, tmp_path):
+    async def check(*stores):
+        for i in range(20):
+            await stores[0].put(f'k{i}', {"path": f"/tmp/{i}.zip"}, ttl=-1)
+        results = await asyncio.gather(*(store.expired() for store in stores))
+        claimed = [key for result in results for key, _ in result]
+        assert sorted(claimed) == sorted(f'k{i}' for i in range(20))
+    run_with_stores(kind, tmp_path, check, workers=3)
+
+
+@pytest.mark.parametrize('kind', ('sqlite', 'redis'))
+def test_namespaces_do_not_share_records(kind, tmp_path):
+    async def main():
+        standin = None
+        if kind == 'sqlite':
+            path = str(tmp_path / 'artifacts.db')
+            artifacts, jobs = index.SQLiteArtifactStore(path), index.SQLiteArtifactStore(path, table='jobs')
+        else:
+            standin = RedisStandin()
+            url = await standin.start()
+            artifacts = index.RedisArtifactStore(url, prefix='test:artifacts')
+            jobs = index.RedisArtifactStore(url, prefix='test:jobs')
+        try:
+            await jobs.put('abc', {"status": {"status": "queued"}}, ttl=60)
+            assert await artifacts.get('abc') is None
+            assert await artifacts.count() == 0
+            assert (await jobs.get('abc'))["status"]["status"] == "queued"
+        finally:
+            await artifacts.close()
+            await jobs.close()
+            if standin is not None:
+                await standin.stop()
+    asyncio.run(main())
+
+
+def test_download_refuses_records_without_a_path():
+    async def main():
+        await index.STORE.put('no-path', {"status": {}}, ttl=60)
+        try:
+            with pytest.raises(index.HTTPException) as error:
+                await index.download_file('no-path')
+            assert error.value.status_code == 404
+        finally:
+            await index.STORE.delete('no-path')
+    asyncio.run(main())
+
+
+def test_redis_nodes_only_claim_their_own_records():
+    async def main():
+        standin = RedisStandin()
+        url = await standin.start()
+        first = index.RedisArtifactStore(url, prefix='test', node='a')
+        second = index.RedisArtifactStore(url, prefix='test', node='b')
+        try:
+            await first.put('from-a', {"path": "/tmp/a.zip", "node": "a"}, ttl=-1)
+            await second.put('from-b', {"path": "/tmp/b.zip", "node": "b"}, ttl=-1)
+            assert [key for key, _ in await first.expired()] == ['from-a']
+            assert [key for key, _ in await first.expired()] == []
+            assert [key for key, _ in await second.expired()] == ['from-b']
+        finally:
+            await first.close()
+            await second.close()
+            await standin.stop()
+    asyncio.run(main())
+
+
+def test_download_leaves_records_of_other_nodes_alone():
+    async def main():
+        await index.STORE.put('remote', {"path": "/nonexistent/remote.zip", "node": index.NODE_ID + '-other'}, ttl=60)
+        try:
+            with pytest.raises(index.HTTPException) as error:
+                await index.download_file('remote')
+            assert error.value.status_code == 404
+            assert await index.STORE.get('remote') is not None
+        finally:
+            await index.STORE.delete('remote')
+    asyncio.run(main())
+
+
+def run_with_standin(check):
+    async def main():
+        standin = RedisStandin()
+        url = await standin.start()
+        store = index.RedisArtifactStore(url, prefix='test', node='a')
+        try:
+            await check(standin, store)
+        finally:
+            await store.close()
+            await standin.stop()
+    asyncio.run(main())
+
+
+def test_redis_cancelled_reply_does_not_leak_into_the_next_command():
+    async def check(standin, store):
+        await store.put('first', {"path": "/tmp/first.zip"}, ttl=60)
+        await store.put('second', {"path": "/tmp/second.zip"}, ttl=60)
+        standin.stall['GET'] = 0.5
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(store.get('first'), 0.1)
+        del standin.stall['GET']
+        assert (await store.get('second'))["path"] == "/tmp/second.zip"
+    run_with_standin(check)
+
+
+def test_redis_retries_reads_but_not_claims():
+    async def check(standin, store):
+        await store.put('k', {"path": "/tmp/k.zip"}, ttl=60)
+        standin.hangup.add('GET')
+        assert (await store.get('k'))["path"] == "/tmp/k.zip"
+        assert standin.commands.count('GET') == 2
+        standin.hangup.add('ZREM')
+        with pytest.raises(ConnectionError):
+            await store.command("ZREM", store._key("exp:a"), "k")
+        assert standin.commands.count('ZREM') == 1
+    run_with_standin(check)